@@ -1,15 +1,33 @@
 import os
 import sys
+import ast
+import shutil
 import tempfile
 import subprocess
 import base64
+import hashlib
+import threading
+import asyncio
+import json
+import re
 import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from fractions import Fraction
 from pathlib import Path
-from typing import Optional
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from fastapi import FastAPI, HTTPException, Request
+from pydantic import BaseModel, Field
+from opentelemetry import context as otel_context
+from opentelemetry import trace
+from opentelemetry.propagate import extract
 import uvicorn
 
+from tracing import setup_tracing
+
+tracer = setup_tracing("manim-mcp-server")
+
 # Create FastAPI app instance
 app = FastAPI(
     title="Manim Animation Server",
@@ -17,10 +35,292 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Container/codec settings for each supported output format
+OUTPUT_FORMATS = {
+    "mp4": {"extension": "mp4", "mime_type": "video/mp4", "codec": "libx264"},
+    "webm": {"extension": "webm", "mime_type": "video/webm", "codec": "libvpx-vp9"},
+    "gif": {"extension": "gif", "mime_type": "image/gif", "codec": "gif"},
+}
+
+# x264 presets, mapped to libvpx-vp9 "-cpu-used" speeds for WebM
+ENCODER_PRESETS = {
+    "ultrafast": 8,
+    "superfast": 7,
+    "veryfast": 6,
+    "faster": 5,
+    "fast": 4,
+    "medium": 3,
+    "slow": 2,
+    "slower": 1,
+    "veryslow": 0,
+}
+
+# Re-encoded H.264 artifacts get a keyframe at least this often so
+# compositions can cut them close to their boundaries
+KEYFRAME_INTERVAL_S = 1.0
+KEYFRAME_EXPR = f"expr:gte(t,n_forced*{KEYFRAME_INTERVAL_S:g})"
+
+# ffprobe H.264 profile names to libx264 -profile values
+H264_PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+    "High 10": "high10",
+    "High 4:2:2": "high422",
+    "High 4:4:4 Predictive": "high444",
+}
+
+# Render quality tiers, highest first. Seed rates are render seconds per
+# unit of estimated scene cost and get refined from completed jobs.
+QUALITY_TIERS = [
+    {"name": "high", "flag": "-qh", "resolution": "1080p", "fps": 60, "seed_rate": 6.0},
+    {"name": "medium", "flag": "-qm", "resolution": "720p", "fps": 30, "seed_rate": 2.5},
+    {"name": "low", "flag": "-ql", "resolution": "480p", "fps": 15, "seed_rate": 1.0},
+]
+DEFAULT_QUALITY_TIER = "low"
+# Cap on a whole render request, across every quality tier it tries
+RENDER_TIMEOUT_S = 300
+
+
 # Request model for HTTP endpoints
 class ManimCodeRequest(BaseModel):
     """Request model for Manim code validation and generation."""
     manim_code: str
+    output_format: Literal["mp4", "webm", "gif"] = "mp4"
+    crf: Optional[int] = Field(default=None, ge=0, le=63)
+    bitrate: Optional[str] = Field(default=None, pattern=r"^\d+[kKmM]?$")
+    preset: Optional[Literal[
+        "ultrafast", "superfast", "veryfast", "faster", "fast",
+        "medium", "slow", "slower", "veryslow",
+    ]] = None
+    gif_fps: int = Field(default=15, ge=1, le=60)
+    gif_width: int = Field(default=480, ge=64, le=1920)
+    poster: bool = True
+    time_budget_s: Optional[float] = Field(default=None, gt=0, le=300)
+    scene_id: Optional[str] = Field(default=None, pattern=r"^[A-Za-z0-9_-]{1,64}$")
+
+    def encoding_options(self) -> dict:
+        """Return the output encoding options of this request."""
+        return self.model_dump(exclude={"manim_code", "time_budget_s", "scene_id"})
+
+class ComposeRequest(BaseModel):
+    """Request model for stitching rendered artifacts into one video."""
+    clips: List[str] = Field(min_length=2, max_length=50)
+    crossfade_s: float = Field(default=0.0, ge=0, le=5)
+    scene_id: Optional[str] = Field(default=None, pattern=r"^[A-Za-z0-9_-]{1,64}$")
+
+class ArtifactStore:
+    """
+    Keeps rendered videos on disk so later requests can reuse them.
+    
+    Each artifact is a directory holding the video and a metadata.json.
+    Artifacts are looked up by artifact ID, or by scene ID in which case
+    the most recent artifact for that scene wins. The oldest artifacts
+    are evicted once the store holds more than max_artifacts.
+    """
+    
+    ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+    
+    def __init__(self, root: Path, max_artifacts: int):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_artifacts = max_artifacts
+        self._lock = threading.Lock()
+    
+    def save(self, video_path: Path, metadata: dict, scene_id: Optional[str] = None) -> str:
+        """Copy a video into the store and return its artifact ID."""
+        artifact_id = uuid.uuid4().hex[:16]
+        artifact_dir = self.root / artifact_id
+        artifact_dir.mkdir()
+        
+        video_name = f"video{video_path.suffix}"
+        shutil.copyfile(video_path, artifact_dir / video_name)
+        with open(artifact_dir / "metadata.json", 'w', encoding='utf-8') as f:
+            json.dump({
+                **metadata,
+                "artifact_id": artifact_id,
+                "scene_id": scene_id,
+                "video_file": video_name,
+                "created_at": time.time(),
+            }, f)
+        
+        self._evict()
+        return artifact_id
+    
+    def get(self, ref: str) -> Optional[dict]:
+        """Return metadata (with the video path) for an artifact or scene ID."""
+        if not self.ID_PATTERN.match(ref):
+            return None
+        
+        if (self.root / ref / "metadata.json").exists():
+            return self._load(self.root / ref)
+        
+        matches = [m for m in self._all() if m.get("scene_id") == ref]
+        if not matches:
+            return None
+        return max(matches, key=lambda m: m["created_at"])
+    
+    def _load(self, artifact_dir: Path) -> Optional[dict]:
+        try:
+            with open(artifact_dir / "metadata.json", 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+        metadata["path"] = artifact_dir / metadata["video_file"]
+        return metadata
+    
+    def _all(self) -> list:
+        artifacts = (self._load(d) for d in self.root.iterdir() if d.is_dir())
+        return [a for a in artifacts if a is not None]
+    
+    def _evict(self):
+        with self._lock:
+            artifacts = sorted(self._all(), key=lambda m: m["created_at"])
+            for metadata in artifacts[:max(len(artifacts) - self.max_artifacts, 0)]:
+                shutil.rmtree(metadata["path"].parent, ignore_errors=True)
+
+class QualityModel:
+    """
+    Predicts render time per quality tier and learns from completed jobs.
+    
+    The prediction is a fixed startup overhead plus a per-tier rate times
+    the scene's estimated cost. Rates are exponentially weighted moving
+    averages persisted next to the execution directories.
+    """
+    
+    OVERHEAD_SECONDS = 3.0
+    SMOOTHING = 0.3
+    # Leave headroom for encoding and prediction error
+    SAFETY_MARGIN = 0.85
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.rates = {tier["name"]: tier["seed_rate"] for tier in QUALITY_TIERS}
+        self.samples = {tier["name"]: 0 for tier in QUALITY_TIERS}
+        
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            self.rates.update({k: float(v) for k, v in saved.get("rates", {}).items() if k in self.rates})
+            self.samples.update({k: int(v) for k, v in saved.get("samples", {}).items() if k in self.samples})
+        except (OSError, ValueError):
+            pass
+    
+    def predict(self, tier_name: str, cost: float) -> float:
+        """Predicted render seconds for a scene of the given cost."""
+        return self.OVERHEAD_SECONDS + self.rates[tier_name] * cost
+    
+    def plan(self, cost: float, time_budget_s: Optional[float]) -> list:
+        """
+        Return the tiers to try, starting with the chosen one.
+        
+        Without a budget the server keeps its default tier. With a budget
+        the highest tier whose prediction fits is chosen, and every lower
+        tier stays available as a fallback.
+        """
+        if time_budget_s is None:
+            return [tier for tier in QUALITY_TIERS if tier["name"] == DEFAULT_QUALITY_TIER]
+        
+        for index, tier in enumerate(QUALITY_TIERS):
+            if self.predict(tier["name"], cost) <= time_budget_s * self.SAFETY_MARGIN:
+                return QUALITY_TIERS[index:]
+        
+        return QUALITY_TIERS[-1:]
+    
+    def update(self, tier_name: str, cost: float, render_time: float):
+        """Fold a completed render into the tier's throughput estimate."""
+        observed = max(render_time - self.OVERHEAD_SECONDS, 0.1) / max(cost, 0.1)
+        
+        with self._lock:
+            self.rates[tier_name] = (1 - self.SMOOTHING) * self.rates[tier_name] + self.SMOOTHING * observed
+            self.samples[tier_name] += 1
+            
+            try:
+                with open(self.path, 'w', encoding='utf-8') as f:
+                    json.dump({"rates": self.rates, "samples": self.samples}, f)
+            except OSError as e:
+                print(f"Warning: Failed to save quality model: {e}")
+
+
+class RenderProgress:
+    """
+    Tracks render progress from manim's per-animation progress bars.
+    
+    Each animation is weighted by its duration from the source, since
+    rendering time grows with frames rather than with play calls.
+    """
+    
+    ANIMATION_PATTERN = re.compile(r"Animation (\d+)\s*:.*?(\d+)%")
+    
+    def __init__(self, durations: list):
+        self.durations = list(durations) or [1.0]
+        self.fraction = 0.0
+        self.first_progress_at = None
+    
+    def update(self, line: str):
+        match = self.ANIMATION_PATTERN.search(line)
+        if not match:
+            return
+        
+        if self.first_progress_at is None:
+            self.first_progress_at = time.time()
+        
+        index = int(match.group(1))
+        percent = int(match.group(2))
+        # Loops make the static animation list a lower bound
+        average = sum(self.durations) / len(self.durations)
+        while len(self.durations) <= index:
+            self.durations.append(average)
+        
+        done = sum(self.durations[:index]) + self.durations[index] * percent / 100.0
+        self.fraction = max(self.fraction, done / sum(self.durations))
+    
+    def projected_time(self, started: float) -> Optional[float]:
+        """
+        Project the total render time, or None before there is enough progress.
+        
+        Startup (imports, inline LaTeX) is a fixed cost, so only the time
+        since the first progress line is scaled by the remaining work.
+        """
+        if self.first_progress_at is None or self.fraction < 0.05:
+            return None
+        animating = time.time() - self.first_progress_at
+        if animating < 2:
+            return None
+        return (self.first_progress_at - started) + animating / self.fraction
+
+
+class RenderPhases:
+    """Splits a manim run into timed phases based on its log output."""
+    
+    def __init__(self, started: float):
+        self.segments = [["startup", started, None]]
+    
+    def _classify(self, line: str) -> Optional[str]:
+        if 'Writing "' in line or ".tex" in line:
+            return "latex"
+        if "Combining to Movie file" in line:
+            return "combine"
+        if RenderProgress.ANIMATION_PATTERN.search(line) or "Partial movie file written" in line:
+            return "animation"
+        return None
+    
+    def update(self, line: str):
+        phase = self._classify(line)
+        if phase is None or phase == self.segments[-1][0]:
+            return
+        now = time.time()
+        self.segments[-1][2] = now
+        self.segments.append([phase, now, None])
+    
+    def record_spans(self, finished: float):
+        """Emit one child span per phase under the current span."""
+        self.segments[-1][2] = finished
+        for phase, started, ended in self.segments:
+            span = tracer.start_span(f"manim.{phase}", start_time=int(started * 1e9))
+            span.end(end_time=int(ended * 1e9))
 
 class ManimExecutor:
     """Handles Manim code execution and video generation."""
@@ -28,21 +328,39 @@ class ManimExecutor:
     def __init__(self):
         self.temp_dir = Path(tempfile.gettempdir()) / "manim_mcp"
         self.temp_dir.mkdir(exist_ok=True)
+        self.quality_model = QualityModel(self.temp_dir / "quality_model.json")
+        self.artifacts = ArtifactStore(
+            self.temp_dir / "artifacts",
+            max_artifacts=int(os.getenv("ARTIFACT_MAX_COUNT", "200")),
+        )
     
-    def execute_manim_code(self, manim_code: str) -> dict:
+    def execute_manim_code(
+        self,
+        manim_code: str,
+        encoding: Optional[dict] = None,
+        time_budget_s: Optional[float] = None,
+        scene_id: Optional[str] = None,
+    ) -> dict:
         """
         Execute Manim code and return the generated video.
         
         Args:
             manim_code: Python code containing Manim scene
+            encoding: Output encoding options (see ManimCodeRequest)
+            time_budget_s: Render time budget used to pick the quality tier
+            scene_id: Optional name to find the stored artifact by later
             
         Returns:
             dict with success status, video_data (base64), and metadata
         """
         start_time = time.time()
+        encoding = encoding or {}
+        cost = estimate_scene_cost(manim_code)
+        tiers = self.quality_model.plan(cost["estimated_cost"], time_budget_s)
+        attempts = []
         
         # Create temporary directory for this execution
-        exec_dir = self.temp_dir / f"exec_{int(time.time() * 1000)}"
+        exec_dir = self.temp_dir / f"exec_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}"
         exec_dir.mkdir(exist_ok=True)
         
         try:
@@ -51,26 +369,104 @@ class ManimExecutor:
             with open(script_path, 'w', encoding='utf-8') as f:
                 f.write(manim_code)
             
-            # Execute Manim via Python module to avoid PATH issues
-            # Manim will handle ffmpeg lookup internally
-            cmd = [
-                sys.executable,
-                "-m",
-                "manim",
-                "-ql",  # Low quality for faster rendering
-                "--media_dir",
-                str(exec_dir / "media"),
-                str(script_path),
-                "GeneratedScene",  # The class name we expect
-            ]
-
-            result = subprocess.run(
-                cmd,
-                cwd=str(exec_dir),
-                capture_output=True,
-                text=True,
-                timeout=300,  # Increased to 5 minutes for complex animations
-            )
+            # Compile the scene's Tex/MathTex strings up front in as few LaTeX runs as possible
+            with tracer.start_as_current_span("latex.batch") as batch_span:
+                latex_batch = self._batch_latex(manim_code, exec_dir)
+                if latex_batch:
+                    batch_span.set_attributes({
+                        "latex.compiled": latex_batch.get("compiled", 0),
+                        "latex.launches_saved": latex_batch.get("launches_saved", 0),
+                    })
+            
+            for index, tier in enumerate(tiers):
+                # Execute Manim via Python module to avoid PATH issues
+                # Manim will handle ffmpeg lookup internally
+                cmd = [
+                    sys.executable,
+                    "-m",
+                    "manim",
+                    tier["flag"],
+                    "--media_dir",
+                    str(exec_dir / "media"),
+                    str(script_path),
+                    "GeneratedScene",  # The class name we expect
+                ]
+                
+                predicted_time = self.quality_model.predict(tier["name"], cost["estimated_cost"])
+                progress = RenderProgress(cost["animation_durations"])
+                can_fall_back = time_budget_s is not None and index < len(tiers) - 1
+                render_start = time.time()
+                # Every attempt shares the one request timeout
+                time_left = RENDER_TIMEOUT_S - (render_start - start_time)
+                if time_left <= 0:
+                    raise subprocess.TimeoutExpired(cmd, RENDER_TIMEOUT_S)
+                
+                def behind_schedule(elapsed: float) -> bool:
+                    # Restart at a lower tier once the budget is spent or the projected finish overruns it
+                    if not can_fall_back:
+                        return False
+                    remaining_budget = time_budget_s - (render_start - start_time)
+                    if elapsed > remaining_budget:
+                        return True
+                    projected = progress.projected_time(render_start)
+                    return projected is not None and projected > remaining_budget
+                
+                phases = RenderPhases(render_start)
+                
+                def on_line(line: str):
+                    progress.update(line)
+                    phases.update(line)
+                
+                with tracer.start_as_current_span("manim.render") as render_span:
+                    render_span.set_attributes({
+                        "manim.quality_tier": tier["name"],
+                        "manim.predicted_time": predicted_time,
+                        "manim.attempt": index,
+                    })
+                    try:
+                        result = self._run_manim(
+                            cmd,
+                            exec_dir,
+                            timeout=time_left,
+                            on_line=on_line,
+                            should_abort=behind_schedule,
+                        )
+                    except subprocess.TimeoutExpired:
+                        if not can_fall_back:
+                            raise
+                        # A lower tier may still fit in what is left
+                        result = subprocess.CompletedProcess(cmd, -9, "", "")
+                        result.aborted = True
+                    finally:
+                        phases.record_spans(time.time())
+                    render_span.set_attributes({
+                        "manim.returncode": result.returncode,
+                        "manim.aborted": result.aborted,
+                    })
+                render_time = time.time() - render_start
+                
+                attempts.append({
+                    "tier": tier["name"],
+                    "predicted_time": round(predicted_time, 2),
+                    "actual_time": round(render_time, 2),
+                    "progress": round(progress.fraction, 3),
+                    "aborted": result.aborted,
+                })
+                
+                if not result.aborted:
+                    break
+                
+                # Learn from the overrun so the same tier isn't picked and aborted again.
+                # Without a projection the time so far is still a lower bound.
+                projected = progress.projected_time(render_start)
+                if projected is not None:
+                    attempts[-1]["projected_time"] = round(projected, 2)
+                overrun = max(projected or 0.0, render_time)
+                if overrun > predicted_time:
+                    self.quality_model.update(tier["name"], cost["estimated_cost"], overrun)
+                
+                # Drop partial output so the fallback render starts clean, keeping the tex cache
+                shutil.rmtree(exec_dir / "media" / "videos", ignore_errors=True)
             
             if result.returncode != 0:
                 # Parse stderr for more specific error message
@@ -103,10 +499,42 @@ class ManimExecutor:
                     "stderr": result.stderr
                 }
             
+            self.quality_model.update(tier["name"], cost["estimated_cost"], render_time)
+            
+            # Transcode into the requested container/codec
+            encoded = self._encode_video(video_path, exec_dir, encoding)
+            
+            if not encoded["success"]:
+                self._cleanup(exec_dir)
+                return encoded
+            
             # Read and encode video
-            with open(video_path, 'rb') as video_file:
+            with open(encoded["path"], 'rb') as video_file:
                 video_data = base64.b64encode(video_file.read()).decode('utf-8')
             
+            # Poster frame for galleries and thumbnails
+            poster_data = None
+            if encoding.get("poster", True):
+                with tracer.start_as_current_span("ffmpeg.poster"):
+                    poster_path = self._generate_poster(video_path, exec_dir)
+                if poster_path:
+                    with open(poster_path, 'rb') as poster_file:
+                        poster_data = base64.b64encode(poster_file.read()).decode('utf-8')
+            
+            # Keep the output so it can be reused in compositions
+            artifact_id = self.artifacts.save(
+                encoded["path"],
+                {
+                    "source": "render",
+                    "format": encoded["encoding"]["format"],
+                    "mime_type": encoded["encoding"]["mime_type"],
+                    "encoding": encoded["encoding"],
+                    "resolution": tier["resolution"],
+                    "fps": tier["fps"],
+                },
+                scene_id=scene_id,
+            )
+            
             execution_time = time.time() - start_time
             
             # Clean up temporary files
@@ -114,10 +542,35 @@ class ManimExecutor:
             
             return {
                 "success": True,
+                "artifact_id": artifact_id,
+                "scene_id": scene_id,
                 "video_data": video_data,
+                "video_format": encoded["encoding"]["format"],
+                "mime_type": encoded["encoding"]["mime_type"],
+                "poster_data": poster_data,
+                "encoding": encoded["encoding"],
+                "encode_time": encoded["encode_time"],
+                "default_size_bytes": encoded["default_size_bytes"],
+                "output_size_bytes": encoded["output_size_bytes"],
+                "size_change_bytes": encoded["output_size_bytes"] - encoded["default_size_bytes"],
+                "size_change_percent": round(
+                    100.0 * (encoded["output_size_bytes"] - encoded["default_size_bytes"])
+                    / max(encoded["default_size_bytes"], 1),
+                    1,
+                ),
                 "execution_time": execution_time,
                 "video_size_bytes": len(video_data),
-                "resolution": "480p",
+                "resolution": tier["resolution"],
+                "fps": tier["fps"],
+                "latex_batch": latex_batch,
+                "quality": {
+                    "tier": tier["name"],
+                    "time_budget_s": time_budget_s,
+                    "predicted_time": attempts[-1]["predicted_time"],
+                    "actual_time": attempts[-1]["actual_time"],
+                    "restarts": len(attempts) - 1,
+                    "attempts": attempts,
+                },
                 "latex": "enabled",
                 "message": "Animation generated successfully with LaTeX support"
             }
@@ -135,6 +588,109 @@ class ManimExecutor:
                 "error": f"Unexpected error: {str(e)}"
             }
     
+    def _batch_latex(self, manim_code: str, exec_dir: Path) -> Optional[dict]:
+        """
+        Seed manim's tex cache with every statically known Tex/MathTex string.
+        
+        Runs tex_batch.py, which compiles the expressions as multi-page
+        documents. Returns its summary, or None when the pre-pass is skipped.
+        Failures are harmless since manim then compiles as usual.
+        """
+        calls = extract_tex_calls(manim_code)
+        if len(calls) < int(os.getenv("TEX_BATCH_MIN_CALLS", "3")):
+            return None
+        if not shutil.which("latex") or not shutil.which("dvisvgm"):
+            return None
+        
+        calls_path = exec_dir / "tex_calls.json"
+        batch_start = time.time()
+        try:
+            with open(calls_path, 'w', encoding='utf-8') as f:
+                json.dump(calls, f)
+            
+            result = subprocess.run(
+                [
+                    sys.executable,
+                    str(Path(__file__).with_name("tex_batch.py")),
+                    str(calls_path),
+                    str(exec_dir / "media"),
+                    os.getenv("TEX_BATCH_WORKERS", "2"),
+                ],
+                cwd=str(exec_dir),
+                capture_output=True,
+                text=True,
+                timeout=180,
+            )
+        except subprocess.TimeoutExpired:
+            return {"seeded": False, "error": "LaTeX batch timed out"}
+        except (subprocess.SubprocessError, OSError, TypeError, ValueError) as e:
+            return {"seeded": False, "error": f"LaTeX batch failed to run: {e}"[:500]}
+        
+        # The summary is the last line; manim may log above it
+        lines = [line for line in result.stdout.splitlines() if line.strip()]
+        try:
+            summary = json.loads(lines[-1])
+        except (IndexError, ValueError):
+            return {"seeded": False, "error": (result.stderr or "No summary from LaTeX batch")[-500:]}
+        
+        summary["batch_time"] = round(time.time() - batch_start, 3)
+        return summary
+    
+    def _run_manim(self, cmd: list, exec_dir: Path, timeout: float, on_line=None, should_abort=None):
+        """
+        Run manim, streaming its output so progress can be watched live.
+        
+        Raises subprocess.TimeoutExpired like subprocess.run. The returned
+        CompletedProcess has an extra ``aborted`` flag set when
+        ``should_abort`` stopped the render early.
+        """
+        process = subprocess.Popen(
+            cmd,
+            cwd=str(exec_dir),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        stdout_lines = []
+        stderr_lines = []
+        
+        def pump(stream, sink):
+            # Universal newlines turn the progress bar's carriage returns into lines
+            for line in stream:
+                sink.append(line)
+                if on_line:
+                    on_line(line)
+        
+        readers = [
+            threading.Thread(target=pump, args=(process.stdout, stdout_lines), daemon=True),
+            threading.Thread(target=pump, args=(process.stderr, stderr_lines), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+        
+        started = time.time()
+        aborted = False
+        while process.poll() is None:
+            elapsed = time.time() - started
+            if elapsed > timeout:
+                process.kill()
+                process.wait()
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            if should_abort and should_abort(elapsed):
+                process.kill()
+                process.wait()
+                aborted = True
+                break
+            time.sleep(0.5)
+        
+        for reader in readers:
+            reader.join(timeout=5)
+        
+        result = subprocess.CompletedProcess(cmd, process.returncode, "".join(stdout_lines), "".join(stderr_lines))
+        result.aborted = aborted
+        return result
+    
     def _find_video_file(self, exec_dir: Path) -> Optional[Path]:
         """Find the generated video file in the media directory."""
         media_dir = exec_dir / "media"
@@ -151,33 +707,1117 @@ class ManimExecutor:
         
         return None
     
+    def _encode_video(self, video_path: Path, exec_dir: Path, encoding: dict) -> dict:
+        """
+        Transcode manim's default MP4 into the requested output format.
+        
+        MP4 without quality settings is only remuxed (stream copy) so the
+        moov atom moves to the front of the file and browsers can start
+        playback before the whole file has downloaded.
+        """
+        output_format = encoding.get("output_format") or "mp4"
+        crf = encoding.get("crf")
+        bitrate = encoding.get("bitrate")
+        preset = encoding.get("preset")
+        fmt = OUTPUT_FORMATS[output_format]
+        default_size = video_path.stat().st_size
+        
+        metadata = {
+            "format": output_format,
+            "container": fmt["extension"],
+            "codec": fmt["codec"],
+            "mime_type": fmt["mime_type"],
+            "crf": None,
+            "bitrate": None,
+            "preset": None,
+            "faststart": False,
+            "stream_copy": False,
+        }
+        
+        remux_only = output_format == "mp4" and crf is None and bitrate is None and preset is None
+        
+        ffmpeg = shutil.which("ffmpeg")
+        if not ffmpeg:
+            if remux_only:
+                # Nothing to change without ffmpeg - return manim's file as is
+                return {
+                    "success": True,
+                    "path": video_path,
+                    "encoding": metadata,
+                    "encode_time": 0.0,
+                    "default_size_bytes": default_size,
+                    "output_size_bytes": default_size,
+                }
+            return {
+                "success": False,
+                "error": "ffmpeg is not installed on the server - only the default MP4 output is available",
+            }
+        
+        if output_format == "mp4" and crf is not None and crf > 51:
+            return {
+                "success": False,
+                "error": "crf must be between 0 and 51 for mp4 output",
+            }
+        
+        output_path = exec_dir / f"output.{fmt['extension']}"
+        cmd = [ffmpeg, "-y", "-loglevel", "error", "-i", str(video_path)]
+        
+        if remux_only:
+            cmd += ["-c", "copy", "-movflags", "+faststart"]
+            metadata.update({"codec": "copy", "faststart": True, "stream_copy": True})
+        elif output_format == "mp4":
+            cmd += ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "copy"]
+            if crf is not None:
+                cmd += ["-crf", str(crf)]
+            if bitrate:
+                cmd += ["-b:v", bitrate]
+            if preset:
+                cmd += ["-preset", preset]
+            cmd += ["-force_key_frames", KEYFRAME_EXPR, "-movflags", "+faststart"]
+            metadata.update({
+                "crf": crf,
+                "bitrate": bitrate,
+                "preset": preset or "medium",
+                "faststart": True,
+                "keyframe_interval": KEYFRAME_INTERVAL_S,
+            })
+        elif output_format == "webm":
+            # VP9 constant quality mode needs an explicit zero target bitrate
+            if crf is None and not bitrate:
+                crf = 33
+            preset = preset or "faster"
+            cmd += ["-c:v", "libvpx-vp9", "-row-mt", "1", "-c:a", "libopus"]
+            if crf is not None:
+                cmd += ["-crf", str(crf)]
+            cmd += ["-b:v", bitrate or "0"]
+            cmd += ["-deadline", "good", "-cpu-used", str(ENCODER_PRESETS[preset])]
+            metadata.update({"crf": crf, "bitrate": bitrate, "preset": preset})
+        else:
+            # Two-pass palette in a single filter graph keeps GIF colours clean
+            gif_fps = encoding.get("gif_fps") or 15
+            gif_width = encoding.get("gif_width") or 480
+            cmd += [
+                "-vf",
+                f"fps={gif_fps},scale={gif_width}:-1:flags=lanczos,"
+                "split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse",
+                "-loop",
+                "0",
+            ]
+            metadata.update({"fps": gif_fps, "width": gif_width})
+        
+        cmd.append(str(output_path))
+        
+        encode_start = time.time()
+        with tracer.start_as_current_span("ffmpeg.encode") as encode_span:
+            encode_span.set_attributes({
+                "ffmpeg.format": output_format,
+                "ffmpeg.codec": metadata["codec"],
+                "ffmpeg.stream_copy": metadata["stream_copy"],
+            })
+            try:
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+            except subprocess.TimeoutExpired:
+                return {
+                    "success": False,
+                    "error": f"Video encoding to {output_format} timed out (>2 minutes). "
+                             "Try a faster preset or a smaller output.",
+                }
+        encode_time = time.time() - encode_start
+        
+        if result.returncode != 0 or not output_path.exists():
+            return {
+                "success": False,
+                "error": f"Video encoding to {output_format} failed",
+                "stderr": result.stderr[-2000:],
+            }
+        
+        return {
+            "success": True,
+            "path": output_path,
+            "encoding": metadata,
+            "encode_time": encode_time,
+            "default_size_bytes": default_size,
+            "output_size_bytes": output_path.stat().st_size,
+        }
+    
+    def _generate_poster(self, video_path: Path, exec_dir: Path) -> Optional[Path]:
+        """Extract a representative JPEG poster frame from the video."""
+        ffmpeg = shutil.which("ffmpeg")
+        if not ffmpeg:
+            return None
+        
+        poster_path = exec_dir / "poster.jpg"
+        # The thumbnail filter skips the black opening frames most scenes start with
+        cmd = [
+            ffmpeg, "-y", "-loglevel", "error",
+            "-i", str(video_path),
+            "-vf", "thumbnail=300",
+            "-frames:v", "1",
+            "-q:v", "3",
+            str(poster_path),
+        ]
+        
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        except subprocess.TimeoutExpired:
+            return None
+        
+        if result.returncode != 0 or not poster_path.exists():
+            return None
+        
+        return poster_path
+    
     def _cleanup(self, exec_dir: Path):
         """Clean up temporary execution directory."""
         try:
-            import shutil
             if exec_dir.exists():
                 shutil.rmtree(exec_dir, ignore_errors=True)
         except Exception as e:
             print(f"Warning: Failed to cleanup {exec_dir}: {e}")
 
 
+class ClipComposer:
+    """
+    Stitches stored artifacts into a new artifact with ffmpeg.
+    
+    Clips whose codec parameters match are joined with the concat demuxer
+    and stream copy, so no frames are re-encoded. Crossfades between H.264
+    clips only re-encode the stretch from the last keyframe before each
+    boundary to the first keyframe after it; a clip with no keyframes
+    clear of its crossfades is re-encoded whole within that stretch.
+    Anything else falls back to a full re-encode. Re-encoded output is video only, as manim scenes
+    are silent unless they add sound explicitly.
+    """
+    
+    # Scheduler cost per second of input video, and the duration assumed
+    # for clips that can't be probed
+    COST_PER_SECOND = 0.5
+    FALLBACK_CLIP_SECONDS = 10.0
+    
+    def __init__(self, artifacts: ArtifactStore, temp_dir: Path):
+        self.artifacts = artifacts
+        self.temp_dir = temp_dir
+    
+    def compose(self, clips: list, crossfade_s: float = 0.0, scene_id: Optional[str] = None) -> dict:
+        """
+        Concatenate artifacts in order and store the result as a new artifact.
+        
+        Args:
+            clips: Artifact or scene IDs, in playback order
+            crossfade_s: Crossfade duration at each boundary, 0 for hard cuts
+            scene_id: Optional scene ID for the composed artifact
+            
+        Returns:
+            dict with success status, video_data (base64), and metadata
+        """
+        start_time = time.time()
+        ffmpeg = shutil.which("ffmpeg")
+        ffprobe = shutil.which("ffprobe")
+        if not ffmpeg or not ffprobe:
+            return {
+                "success": False,
+                "error": "ffmpeg and ffprobe are required on the server for composition",
+            }
+        
+        artifacts = []
+        for ref in clips:
+            artifact = self.artifacts.get(ref)
+            if artifact is None:
+                return {"success": False, "error": f"Unknown artifact or scene ID: {ref}"}
+            artifacts.append(artifact)
+        
+        work_dir = self.temp_dir / f"compose_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}"
+        work_dir.mkdir()
+        
+        try:
+            probes = [self._probe(ffprobe, a["path"]) for a in artifacts]
+            durations = [p["duration"] for p in probes]
+            
+            # Whole frames only, so re-encoded transitions line up with the copied clips
+            fps = Fraction(probes[0]["r_frame_rate"])
+            if crossfade_s and fps:
+                crossfade_s = float(max(round(crossfade_s * fps), 1) / fps)
+            
+            if crossfade_s and crossfade_s >= min(durations):
+                return {
+                    "success": False,
+                    "error": f"crossfade_s must be shorter than the shortest clip ({min(durations):.2f}s)",
+                }
+            
+            compatible = all(p["signature"] == probes[0]["signature"] for p in probes)
+            plan = None
+            if crossfade_s and compatible and self._can_cut_boundaries(probes):
+                keyframes = [self._keyframes(ffprobe, a["path"]) for a in artifacts]
+                plan = self._plan_boundaries(durations, keyframes, crossfade_s)
+            
+            if not crossfade_s and compatible:
+                mode = "stream_copy"
+                reencoded_seconds = 0.0
+                output_path = work_dir / f"composed{artifacts[0]['path'].suffix}"
+                self._concat_copy(ffmpeg, [a["path"] for a in artifacts], work_dir, output_path)
+            elif plan is not None:
+                mode = "boundary_reencode"
+                output_path = work_dir / "composed.mp4"
+                reencoded_seconds = self._concat_with_crossfades(
+                    ffmpeg, artifacts, durations, probes[0], plan, crossfade_s, work_dir, output_path
+                )
+            else:
+                mode = "reencode"
+                output_path = work_dir / "composed.mp4"
+                self._reencode(ffmpeg, artifacts, probes, crossfade_s, output_path)
+                reencoded_seconds = sum(durations) - crossfade_s * (len(durations) - 1)
+            
+            output_format = output_path.suffix.lstrip(".")
+            mime_type = OUTPUT_FORMATS.get(output_format, OUTPUT_FORMATS["mp4"])["mime_type"]
+            artifact_id = self.artifacts.save(
+                output_path,
+                {
+                    "source": "composition",
+                    "format": output_format,
+                    "mime_type": mime_type,
+                    "resolution": f"{probes[0]['width']}x{probes[0]['height']}",
+                    "components": [a["artifact_id"] for a in artifacts],
+                    "crossfade_s": round(crossfade_s, 3),
+                    "mode": mode,
+                },
+                scene_id=scene_id,
+            )
+            
+            with open(output_path, 'rb') as video_file:
+                video_data = base64.b64encode(video_file.read()).decode('utf-8')
+            
+            return {
+                "success": True,
+                "artifact_id": artifact_id,
+                "scene_id": scene_id,
+                "video_data": video_data,
+                "video_format": output_format,
+                "mime_type": mime_type,
+                "composition": {
+                    "components": [a["artifact_id"] for a in artifacts],
+                    "mode": mode,
+                    "crossfade_s": round(crossfade_s, 3),
+                    "duration": round(sum(durations) - crossfade_s * (len(durations) - 1), 3),
+                    "reencoded_seconds": round(reencoded_seconds, 3),
+                },
+                "compose_time": time.time() - start_time,
+                "video_size_bytes": len(video_data),
+                "message": f"Composed {len(artifacts)} clips ({mode})",
+            }
+        except subprocess.CalledProcessError as e:
+            return {
+                "success": False,
+                "error": "Composition failed in ffmpeg",
+                "stderr": (e.stderr or "")[-2000:],
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Unexpected error: {str(e)}"
+            }
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    def estimate_cost(self, clips: list) -> dict:
+        """
+        Estimate the cost of composing the clips for the scheduler.
+        
+        Costed as a full re-encode of their total duration, the worst case.
+        """
+        ffprobe = shutil.which("ffprobe")
+        clip_seconds = 0.0
+        for ref in clips:
+            artifact = self.artifacts.get(ref)
+            if artifact is None:
+                continue
+            try:
+                clip_seconds += float(self._run([
+                    ffprobe, "-v", "error",
+                    "-show_entries", "format=duration",
+                    "-of", "csv=p=0",
+                    str(artifact["path"]),
+                ]).strip())
+            except (TypeError, ValueError, OSError, subprocess.SubprocessError):
+                clip_seconds += self.FALLBACK_CLIP_SECONDS
+        
+        return {
+            "clips": len(clips),
+            "clip_seconds": round(clip_seconds, 2),
+            "estimated_cost": round(2.0 + clip_seconds * self.COST_PER_SECOND, 2),
+        }
+    
+    def _run(self, cmd: list) -> str:
+        return subprocess.run(cmd, capture_output=True, text=True, timeout=300, check=True).stdout
+    
+    def _probe(self, ffprobe: str, path: Path) -> dict:
+        """Codec parameters that must match for a stream-copy concat."""
+        output = self._run([
+            ffprobe, "-v", "error",
+            "-show_entries",
+            "stream=codec_type,codec_name,profile,level,refs,width,height,pix_fmt,r_frame_rate,time_base,"
+            "sample_rate,channels,extradata_hash",
+            "-show_entries", "format=duration",
+            "-show_data_hash", "sha256",
+            "-of", "json",
+            str(path),
+        ])
+        info = json.loads(output)
+        video = next(st for st in info["streams"] if st["codec_type"] == "video")
+        audio = next((st for st in info["streams"] if st["codec_type"] == "audio"), None)
+        
+        return {
+            "codec_name": video["codec_name"],
+            "width": video["width"],
+            "height": video["height"],
+            "pix_fmt": video.get("pix_fmt"),
+            "profile": video.get("profile"),
+            "level": video.get("level"),
+            "refs": video.get("refs"),
+            "r_frame_rate": video["r_frame_rate"],
+            "has_audio": audio is not None,
+            "duration": float(info["format"]["duration"]),
+            # The concat demuxer keeps only the first file's parameter sets (avcC)
+            "signature": (
+                path.suffix,
+                video["codec_name"], video.get("profile"), video.get("level"), video.get("refs"),
+                video.get("extradata_hash"),
+                video["width"], video["height"], video.get("pix_fmt"),
+                video["r_frame_rate"], video.get("time_base"),
+                audio and (audio["codec_name"], audio.get("sample_rate"), audio.get("channels")),
+            ),
+        }
+    
+    def _keyframes(self, ffprobe: str, path: Path) -> list:
+        output = self._run([
+            ffprobe, "-v", "error",
+            "-select_streams", "v:0",
+            "-skip_frame", "nokey",
+            "-show_entries", "frame=pts_time",
+            "-of", "csv=p=0",
+            str(path),
+        ])
+        times = []
+        for line in output.split():
+            value = line.split(",")[0]
+            if value and value != "N/A":
+                times.append(float(value))
+        return sorted(times)
+    
+    def _can_cut_boundaries(self, probes: list) -> bool:
+        first = probes[0]
+        return first["codec_name"] == "h264" and first["profile"] in H264_PROFILES and not first["has_audio"]
+    
+    def _plan_boundaries(self, durations: list, keyframes: list, crossfade_s: float) -> Optional[list]:
+        """
+        Find the keyframe-aligned body of each clip that can be stream-copied.
+        
+        Returns (copy_start, copy_end) per clip, or None for a clip whose
+        keyframes are too sparse to leave a body clear of its crossfades;
+        such a clip is re-encoded whole as part of the transition. Returns
+        None if no clip has a body at all.
+        """
+        plan = []
+        last = len(durations) - 1
+        for index, duration in enumerate(durations):
+            # The incoming crossfade covers the head, the outgoing one the tail
+            if index == 0:
+                copy_start = 0.0
+            else:
+                copy_start = min((k for k in keyframes[index] if k >= crossfade_s), default=duration)
+            if index == last:
+                copy_end = duration
+            else:
+                copy_end = max((k for k in keyframes[index] if k <= duration - crossfade_s), default=0.0)
+            plan.append((copy_start, copy_end) if copy_end > copy_start else None)
+        
+        if not any(plan):
+            return None
+        return plan
+    
+    def _concat_copy(self, ffmpeg: str, paths: list, work_dir: Path, output_path: Path):
+        list_path = work_dir / "concat.txt"
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for path in paths:
+                escaped = str(Path(path).resolve()).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        
+        cmd = [ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", str(list_path), "-c", "copy"]
+        if output_path.suffix == ".mp4":
+            cmd += ["-movflags", "+faststart"]
+        cmd.append(str(output_path))
+        self._run(cmd)
+    
+    def _concat_with_crossfades(
+        self,
+        ffmpeg: str,
+        artifacts: list,
+        durations: list,
+        params: dict,
+        plan: list,
+        crossfade_s: float,
+        work_dir: Path,
+        output_path: Path,
+    ) -> float:
+        """Stream-copy clip bodies and re-encode only the crossfade regions."""
+        # Half a frame of slack so float cut times never miss the keyframe they aim at
+        half_frame = float(1 / (2 * Fraction(params["r_frame_rate"])))
+        segments = []
+        reencoded_seconds = 0.0
+        # (clip index, start, end or None for the clip's end) waiting to be crossfaded together
+        pieces = []
+        
+        for index, body in enumerate(plan):
+            if body is None:
+                # No body to copy, so the whole clip goes into the transition
+                pieces.append((index, 0.0, None))
+                continue
+            
+            copy_start, copy_end = body
+            if pieces:
+                pieces.append((index, 0.0, copy_start))
+                segment = work_dir / f"segment_{len(segments):03d}.ts"
+                reencoded_seconds += self._encode_transition(
+                    ffmpeg, artifacts, durations, params, pieces, crossfade_s, half_frame, segment
+                )
+                segments.append(segment)
+                pieces = []
+            
+            # The segment muxer splits exactly on keyframes, where -t on a
+            # stream copy would overshoot by the B-frame reorder delay
+            source = artifacts[index]["path"]
+            cuts = [t for t in (copy_start, copy_end) if 0 < t < durations[index]]
+            pattern = work_dir / f"clip_{index:03d}_%03d.ts"
+            cmd = [ffmpeg, "-y", "-loglevel", "error", "-i", str(source), "-map", "0:v", "-c", "copy",
+                   "-bsf:v", "h264_mp4toannexb"]
+            if cuts:
+                cmd += ["-f", "segment", "-segment_times", ",".join(f"{t:.6f}" for t in cuts),
+                        "-segment_time_delta", f"{half_frame:.6f}",
+                        "-segment_format", "mpegts", "-reset_timestamps", "1"]
+            else:
+                cmd += ["-f", "segment", "-segment_time", "86400", "-segment_format", "mpegts"]
+            cmd.append(str(pattern))
+            self._run(cmd)
+            segments.append(work_dir / f"clip_{index:03d}_{1 if copy_start > 0 else 0:03d}.ts")
+            
+            if index < len(plan) - 1:
+                pieces = [(index, copy_end, None)]
+        
+        if pieces:
+            segment = work_dir / f"segment_{len(segments):03d}.ts"
+            reencoded_seconds += self._encode_transition(
+                ffmpeg, artifacts, durations, params, pieces, crossfade_s, half_frame, segment
+            )
+            segments.append(segment)
+        
+        self._concat_copy(ffmpeg, segments, work_dir, output_path)
+        return reencoded_seconds
+    
+    def _encode_transition(
+        self,
+        ffmpeg: str,
+        artifacts: list,
+        durations: list,
+        params: dict,
+        pieces: list,
+        crossfade_s: float,
+        half_frame: float,
+        segment: Path,
+    ) -> float:
+        """Crossfade consecutive clip pieces into one segment and return its length."""
+        cmd = [ffmpeg, "-y", "-loglevel", "error"]
+        lengths = []
+        for index, start, end in pieces:
+            # Seek half a frame early so the keyframe at start is kept, and stop
+            # half a frame early so the keyframe at end is left to the copied body
+            if start > 0:
+                cmd += ["-ss", f"{start - half_frame:.6f}"]
+            if end is not None:
+                cmd += ["-t", f"{end - max(start - half_frame, 0.0) - half_frame:.6f}"]
+            cmd += ["-i", str(artifacts[index]["path"])]
+            lengths.append((durations[index] if end is None else end) - start)
+        
+        filters = [f"[{i}:v]setpts=PTS-STARTPTS[p{i}]" for i in range(len(pieces))]
+        previous = "p0"
+        offset = 0.0
+        for i in range(1, len(pieces)):
+            offset += lengths[i - 1] - crossfade_s
+            filters.append(
+                f"[{previous}][p{i}]xfade=transition=fade:duration={crossfade_s}:offset={offset:.6f}[x{i}]"
+            )
+            previous = f"x{i}"
+        filters.append(f"[{previous}]format={params['pix_fmt'] or 'yuv420p'}[v]")
+        
+        self._run(cmd + [
+            "-filter_complex", ";".join(filters),
+            "-map", "[v]",
+            "-r", params["r_frame_rate"],
+            "-c:v", "libx264", "-crf", "18", "-preset", "veryfast",
+            # Match the copied clips' stream parameters
+            "-profile:v", H264_PROFILES[params["profile"]],
+            *(["-level", f"{params['level'] / 10:g}"] if params["level"] and params["level"] > 0 else []),
+            *(["-refs", str(params["refs"])] if params["refs"] else []),
+            "-bsf:v", "h264_mp4toannexb",
+            "-f", "mpegts",
+            str(segment),
+        ])
+        return sum(lengths) - crossfade_s * (len(pieces) - 1)
+    
+    def _reencode(self, ffmpeg: str, artifacts: list, probes: list, crossfade_s: float, output_path: Path):
+        """Normalise every clip to the first clip's size and frame rate and join them."""
+        width, height = probes[0]["width"], probes[0]["height"]
+        fps = probes[0]["r_frame_rate"]
+        
+        cmd = [ffmpeg, "-y", "-loglevel", "error"]
+        for artifact in artifacts:
+            cmd += ["-i", str(artifact["path"])]
+        
+        filters = [
+            f"[{i}:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,fps={fps},format=yuv420p,setsar=1[v{i}]"
+            for i in range(len(artifacts))
+        ]
+        
+        if crossfade_s:
+            previous = "v0"
+            offset = 0.0
+            for i in range(1, len(artifacts)):
+                offset += probes[i - 1]["duration"] - crossfade_s
+                label = "out" if i == len(artifacts) - 1 else f"x{i}"
+                filters.append(
+                    f"[{previous}][v{i}]xfade=transition=fade:duration={crossfade_s}:offset={offset:.6f}[{label}]"
+                )
+                previous = label
+        else:
+            inputs = "".join(f"[v{i}]" for i in range(len(artifacts)))
+            filters.append(f"{inputs}concat=n={len(artifacts)}:v=1:a=0[out]")
+        
+        cmd += [
+            "-filter_complex", ";".join(filters),
+            "-map", "[out]",
+            "-c:v", "libx264", "-crf", "18", "-preset", "veryfast",
+            "-movflags", "+faststart",
+            str(output_path),
+        ]
+        self._run(cmd)
+
+
+def estimate_scene_cost(manim_code: str) -> dict:
+    """
+    Estimate the render cost of a scene from its source.
+    
+    Sums the animated duration (wait() and run_time), counts Tex/MathTex
+    objects and detects 3D scenes. The cost is a rough CPU-second figure
+    used only for ordering work, not for enforcing limits.
+    """
+    animated_seconds = 0.0
+    # (line, column, seconds) of each play/wait call, sorted into source order below
+    animations = []
+    play_calls = 0
+    wait_calls = 0
+    tex_count = 0
+    is_3d = False
+    
+    try:
+        tree = ast.parse(manim_code)
+    except SyntaxError:
+        tree = None
+    
+    if tree is not None:
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ClassDef):
+                for base in node.bases:
+                    if isinstance(base, ast.Name) and "ThreeD" in base.id:
+                        is_3d = True
+            if not isinstance(node, ast.Call):
+                continue
+            
+            if isinstance(node.func, ast.Attribute):
+                name = node.func.attr
+            elif isinstance(node.func, ast.Name):
+                name = node.func.id
+            else:
+                continue
+            
+            if name in ("Tex", "MathTex", "SingleStringMathTex"):
+                tex_count += 1
+            elif name == "wait":
+                wait_calls += 1
+                duration = 1.0
+                if node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, (int, float)):
+                    duration = float(node.args[0].value)
+                animated_seconds += duration
+                animations.append((node.lineno, node.col_offset, duration))
+            elif name == "play":
+                play_calls += 1
+                duration = 1.0
+                for keyword in node.keywords:
+                    if keyword.arg == "run_time" and isinstance(keyword.value, ast.Constant) \
+                            and isinstance(keyword.value.value, (int, float)):
+                        duration = float(keyword.value.value)
+                animated_seconds += duration
+                animations.append((node.lineno, node.col_offset, duration))
+    else:
+        # Unparseable code fails fast in manim, but count what we can
+        tex_count = manim_code.count("Tex(")
+        is_3d = "ThreeDScene" in manim_code
+    
+    per_second = 4.0 if is_3d else 1.0
+    cost = 2.0 + animated_seconds * per_second + tex_count * 0.5
+    
+    return {
+        "animated_seconds": round(animated_seconds, 2),
+        "play_calls": play_calls,
+        "wait_calls": wait_calls,
+        "animation_durations": [duration for _, _, duration in sorted(animations)],
+        "tex_count": tex_count,
+        "is_3d": is_3d,
+        "estimated_cost": round(cost, 2),
+    }
+
+
+def extract_tex_calls(manim_code: str) -> list:
+    """
+    Statically extract Tex/MathTex calls whose TeX input is fully literal.
+    
+    Only keyword arguments that change the compiled TeX are kept. Calls
+    with a custom tex_template, **kwargs or non-literal strings are
+    skipped and left for manim to compile during the render.
+    """
+    try:
+        tree = ast.parse(manim_code)
+    except SyntaxError:
+        return []
+    
+    calls = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        name = node.func.id if isinstance(node.func, ast.Name) else getattr(node.func, "attr", None)
+        if name not in ("Tex", "MathTex"):
+            continue
+        
+        try:
+            args = [ast.literal_eval(arg) for arg in node.args]
+        except (ValueError, TypeError):
+            continue
+        if not args or not all(isinstance(arg, (str, int, float)) for arg in args):
+            continue
+        
+        kwargs = {}
+        supported = True
+        for keyword in node.keywords:
+            if keyword.arg is None or keyword.arg == "tex_template":
+                supported = False
+                break
+            if keyword.arg == "tex_to_color_map":
+                # Only the keys matter for compilation; colours are applied afterwards
+                if not isinstance(keyword.value, ast.Dict):
+                    supported = False
+                    break
+                keys = [k.value for k in keyword.value.keys if isinstance(k, ast.Constant)]
+                if len(keys) != len(keyword.value.keys):
+                    supported = False
+                    break
+                kwargs["tex_to_color_map"] = {key: None for key in keys}
+            elif keyword.arg in ("arg_separator", "tex_environment", "substrings_to_isolate"):
+                try:
+                    kwargs[keyword.arg] = ast.literal_eval(keyword.value)
+                except (ValueError, TypeError):
+                    supported = False
+                    break
+        
+        if supported:
+            calls.append({"class": name, "args": args, "kwargs": kwargs})
+    
+    return calls
+
+
+def _parse_client_weights(value: str) -> dict:
+    """Parse "client=weight,client=weight" into a dict."""
+    weights = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        client_id, weight = item.split("=", 1)
+        try:
+            weights[client_id.strip()] = max(float(weight), 0.01)
+        except ValueError:
+            continue
+    return weights
+
+
+class QuotaExceededError(Exception):
+    """Raised when a client has used up its CPU-second quota or queue limit."""
+
+
+class RenderScheduler:
+    """
+    Cost-aware fair scheduler in front of ManimExecutor and ClipComposer.
+    
+    Clients are served by weighted fair queuing: each client carries a
+    virtual time that advances by job cost / weight when one of its jobs
+    is dispatched, and the backlogged client with the lowest virtual time
+    goes next. Within a client the shortest job runs first, with aging so
+    long jobs are not starved. Idle clients are dropped once their usage
+    leaves the quota window; a returning client restarts at the global
+    virtual time, which is what an idle client would be reset to anyway.
+    """
+    
+    def __init__(self, executor: "ManimExecutor", composer: "ClipComposer"):
+        self.executor = executor
+        self.composer = composer
+        self.workers = int(os.getenv("SCHEDULER_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+        self.client_concurrency = int(os.getenv("SCHEDULER_CLIENT_CONCURRENCY", "1"))
+        # CPU seconds per client per quota window, 0 disables the quota
+        self.client_cpu_seconds = float(os.getenv("SCHEDULER_CLIENT_CPU_SECONDS", "0"))
+        self.quota_window = float(os.getenv("SCHEDULER_QUOTA_WINDOW", "3600"))
+        self.client_max_queued = int(os.getenv("SCHEDULER_CLIENT_MAX_QUEUED", "20"))
+        # Estimated cost-seconds forgiven per second spent waiting
+        self.aging_rate = float(os.getenv("SCHEDULER_AGING_RATE", "1.0"))
+        self.client_weights = _parse_client_weights(os.getenv("SCHEDULER_CLIENT_WEIGHTS", ""))
+        
+        self._lock = threading.Condition()
+        self._clients = {}
+        self._virtual_time = 0.0
+        self._completed = 0
+        self._threads = []
+    
+    def _new_client(self) -> dict:
+        return {
+            "queue": [],
+            "running": 0,
+            "virtual_time": self._virtual_time,
+            "usage": deque(),
+            # Predicted CPU seconds of queued and running jobs
+            "reserved": 0.0,
+        }
+    
+    def _prune(self, client_id: Optional[str] = None):
+        """Forget idle clients with no usage left in the quota window. Caller holds the lock."""
+        client_ids = [client_id] if client_id is not None else list(self._clients)
+        for cid in client_ids:
+            client = self._clients.get(cid)
+            # Usage only has to be kept while a quota is enforced
+            in_quota = client and self.client_cpu_seconds and self._cpu_used(client)
+            if client and not client["queue"] and not client["running"] and not in_quota:
+                del self._clients[cid]
+    
+    def _cpu_used(self, client: dict) -> float:
+        cutoff = time.time() - self.quota_window
+        while client["usage"] and client["usage"][0][0] < cutoff:
+            client["usage"].popleft()
+        return sum(seconds for _, seconds in client["usage"])
+    
+    def _start_workers(self):
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"render-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def submit(
+        self,
+        client_id: str,
+        manim_code: str,
+        encoding: Optional[dict] = None,
+        time_budget_s: Optional[float] = None,
+        scene_id: Optional[str] = None,
+    ) -> Future:
+        """Queue a render job and return a future for its result."""
+        cost = estimate_scene_cost(manim_code)
+        quality_model = self.executor.quality_model
+        tier_name = quality_model.plan(cost["estimated_cost"], time_budget_s)[0]["name"]
+        
+        def run():
+            return self.executor.execute_manim_code(
+                manim_code,
+                encoding,
+                time_budget_s=time_budget_s,
+                scene_id=scene_id,
+            )
+        
+        return self._enqueue(
+            client_id,
+            cost,
+            quality_model.predict(tier_name, cost["estimated_cost"]),
+            run,
+            "manim.execute",
+        )
+    
+    def submit_composition(
+        self,
+        client_id: str,
+        clips: list,
+        crossfade_s: float = 0.0,
+        scene_id: Optional[str] = None,
+    ) -> Future:
+        """Queue a composition job and return a future for its result. Probes the clips."""
+        cost = self.composer.estimate_cost(clips)
+        
+        def run():
+            return self.composer.compose(clips, crossfade_s, scene_id)
+        
+        return self._enqueue(client_id, cost, cost["estimated_cost"], run, "compose.execute")
+    
+    def _enqueue(self, client_id: str, cost: dict, predicted_seconds: float, run, span_name: str) -> Future:
+        future = Future()
+        
+        with self._lock:
+            self._start_workers()
+            self._prune()
+            # Only clients that pass the checks below get an entry
+            client = self._clients.get(client_id) or self._new_client()
+            
+            if len(client["queue"]) >= self.client_max_queued:
+                raise QuotaExceededError(
+                    f"Client '{client_id}' already has {len(client['queue'])} queued jobs "
+                    f"(limit {self.client_max_queued})"
+                )
+            
+            # Jobs still waiting or running count against the quota too, so a burst can't overdraw it
+            committed = self._cpu_used(client) + client["reserved"]
+            if self.client_cpu_seconds and committed >= self.client_cpu_seconds:
+                raise QuotaExceededError(
+                    f"Client '{client_id}' exceeded its quota of {self.client_cpu_seconds:.0f} "
+                    f"CPU seconds per {self.quota_window:.0f}s"
+                )
+            
+            # An idle client must not bank credit from the time it was away
+            if not client["queue"] and not client["running"]:
+                client["virtual_time"] = max(client["virtual_time"], self._virtual_time)
+            
+            job = {
+                "run": run,
+                "span_name": span_name,
+                "cost": cost,
+                "predicted_seconds": predicted_seconds,
+                "submitted_at": time.time(),
+                "trace_context": otel_context.get_current(),
+                "queue_depth": sum(len(c["queue"]) for c in self._clients.values()),
+                "future": future,
+            }
+            self._clients[client_id] = client
+            client["queue"].append(job)
+            client["reserved"] += predicted_seconds
+            self._lock.notify()
+        
+        future.add_done_callback(lambda f: f.cancelled() and self._discard(client_id, job))
+        return future
+    
+    def _discard(self, client_id: str, job: dict):
+        """Free the queue slot and quota reservation of a cancelled job."""
+        with self._lock:
+            client = self._clients.get(client_id)
+            if client and job in client["queue"]:
+                client["queue"].remove(job)
+                client["reserved"] -= job["predicted_seconds"]
+                self._prune(client_id)
+    
+    def _next_job(self):
+        """Pick the next job to run, or None. Caller holds the lock."""
+        now = time.time()
+        
+        while True:
+            best_client_id = None
+            for client_id, client in self._clients.items():
+                if not client["queue"] or client["running"] >= self.client_concurrency:
+                    continue
+                if best_client_id is None or client["virtual_time"] < self._clients[best_client_id]["virtual_time"]:
+                    best_client_id = client_id
+            
+            if best_client_id is None:
+                return None
+            
+            client = self._clients[best_client_id]
+            job = min(
+                client["queue"],
+                key=lambda j: j["cost"]["estimated_cost"] - self.aging_rate * (now - j["submitted_at"]),
+            )
+            client["queue"].remove(job)
+            
+            # Drop jobs whose caller went away; a running future can no longer be cancelled
+            if job["future"].set_running_or_notify_cancel():
+                break
+            client["reserved"] -= job["predicted_seconds"]
+        
+        client["running"] += 1
+        
+        self._virtual_time = client["virtual_time"]
+        weight = self.client_weights.get(best_client_id, 1.0)
+        client["virtual_time"] += job["cost"]["estimated_cost"] / weight
+        
+        job["client_id"] = best_client_id
+        job["started_at"] = now
+        return job
+    
+    def _worker(self):
+        while True:
+            with self._lock:
+                job = self._next_job()
+                while job is None:
+                    self._lock.wait()
+                    job = self._next_job()
+            
+            # Continue the submitting request's trace on this worker thread
+            token = otel_context.attach(job["trace_context"])
+            try:
+                queue_span = tracer.start_span(
+                    "scheduler.queue",
+                    start_time=int(job["submitted_at"] * 1e9),
+                    attributes={
+                        "scheduler.client_id": job["client_id"],
+                        "scheduler.estimated_cost": job["cost"]["estimated_cost"],
+                    },
+                )
+                queue_span.end(end_time=int(job["started_at"] * 1e9))
+                
+                with tracer.start_as_current_span(job["span_name"]):
+                    result = job["run"]()
+            except Exception as e:
+                result = {"success": False, "error": f"Unexpected error: {str(e)}"}
+            finally:
+                otel_context.detach(token)
+            
+            run_time = time.time() - job["started_at"]
+            result["scheduling"] = {
+                "client_id": job["client_id"],
+                "queue_wait_time": round(job["started_at"] - job["submitted_at"], 3),
+                "queue_depth_at_submit": job["queue_depth"],
+                "run_time": round(run_time, 3),
+                **{key: value for key, value in job["cost"].items() if key != "animation_durations"},
+            }
+            
+            with self._lock:
+                client = self._clients[job["client_id"]]
+                client["running"] -= 1
+                client["reserved"] -= job["predicted_seconds"]
+                client["usage"].append((time.time(), run_time))
+                self._completed += 1
+                self._lock.notify_all()
+            
+            try:
+                job["future"].set_result(result)
+            except InvalidStateError:
+                pass
+    
+    def get_stats(self) -> dict:
+        """
+        Queue and usage snapshot for the status endpoint.
+        
+        Totals only, since the endpoint is unauthenticated and client IDs
+        can be other users' addresses.
+        """
+        with self._lock:
+            self._prune()
+            clients = list(self._clients.values())
+            return {
+                "workers": self.workers,
+                "client_concurrency": self.client_concurrency,
+                "client_cpu_seconds": self.client_cpu_seconds or None,
+                "client_max_queued": self.client_max_queued,
+                "quota_window": self.quota_window,
+                "clients": len(clients),
+                "queued": sum(len(client["queue"]) for client in clients),
+                "running": sum(client["running"] for client in clients),
+                "completed": self._completed,
+                "cpu_seconds_used": round(sum(self._cpu_used(client) for client in clients), 1),
+                "cpu_seconds_reserved": round(sum(client["reserved"] for client in clients), 1),
+            }
+
+
+def get_client_id(request: Request) -> str:
+    """Identify the client by X-Client-ID, API key or remote address."""
+    client_id = request.headers.get("x-client-id")
+    if client_id:
+        return client_id[:64]
+    
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        # Never keep raw keys around in scheduler state
+        return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+    
+    return request.client.host if request.client else "anonymous"
+
+
 # Global executor instance
 executor = ManimExecutor()
+composer = ClipComposer(executor.artifacts, executor.temp_dir)
+scheduler = RenderScheduler(executor, composer)
 
 
 # HTTP Endpoints for FastAPI
 @app.post("/generate_animation")
-async def http_generate_animation(request: ManimCodeRequest):
+async def http_generate_animation(request: ManimCodeRequest, http_request: Request):
     """
     HTTP endpoint to generate animation from Manim code.
     """
     try:
-        result = executor.execute_manim_code(request.manim_code)
+        with tracer.start_as_current_span(
+            "POST /generate_animation",
+            context=extract(http_request.headers),
+            kind=trace.SpanKind.SERVER,
+        ) as span:
+            client_id = get_client_id(http_request)
+            span.set_attribute("scheduler.client_id", client_id)
+            future = scheduler.submit(
+                client_id,
+                request.manim_code,
+                request.encoding_options(),
+                time_budget_s=request.time_budget_s,
+                scene_id=request.scene_id,
+            )
+            result = await asyncio.wrap_future(future)
+            if span.get_span_context().is_valid:
+                result["trace_id"] = format(span.get_span_context().trace_id, "032x")
         return result
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/compose_animation")
+async def http_compose_animation(request: ComposeRequest, http_request: Request):
+    """
+    HTTP endpoint to stitch previously rendered artifacts into one video.
+    """
+    try:
+        with tracer.start_as_current_span(
+            "POST /compose_animation",
+            context=extract(http_request.headers),
+            kind=trace.SpanKind.SERVER,
+        ) as span:
+            client_id = get_client_id(http_request)
+            span.set_attribute("scheduler.client_id", client_id)
+            # Probing the clips for the cost estimate blocks, so keep it off the event loop
+            future = await asyncio.to_thread(
+                scheduler.submit_composition,
+                client_id,
+                request.clips,
+                request.crossfade_s,
+                request.scene_id,
+            )
+            return await asyncio.wrap_future(future)
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/artifacts/{artifact_id}")
+async def http_get_artifact(artifact_id: str):
+    """
+    HTTP endpoint to look up stored artifact metadata by artifact or scene ID.
+    """
+    artifact = executor.artifacts.get(artifact_id)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail=f"Unknown artifact or scene ID: {artifact_id}")
+    
+    artifact.pop("path")
+    return artifact
+
+
 @app.post("/validate_manim_code")
 async def http_validate_manim_code(request: ManimCodeRequest):
     """
@@ -230,7 +1870,20 @@ async def http_get_status():
         "python_version": platform.python_version(),
         "temp_directory": str(executor.temp_dir),
         "latex": "enabled",
-        "available_endpoints": ["/generate_animation", "/validate_manim_code", "/status"]
+        "output_formats": list(OUTPUT_FORMATS),
+        "ffmpeg": shutil.which("ffmpeg") is not None,
+        "scheduler": scheduler.get_stats(),
+        "quality_model": {
+            "rates": executor.quality_model.rates,
+            "samples": executor.quality_model.samples,
+        },
+        "available_endpoints": [
+            "/generate_animation",
+            "/compose_animation",
+            "/artifacts/{artifact_id}",
+            "/validate_manim_code",
+            "/status",
+        ]
     }
 
 
@@ -243,6 +1896,8 @@ async def root():
         "description": "MCP server for generating Manim animations via HTTP",
         "endpoints": {
             "POST /generate_animation": "Generate animation from Manim code",
+            "POST /compose_animation": "Stitch rendered artifacts into one video",
+            "GET /artifacts/{artifact_id}": "Get stored artifact metadata",
             "POST /validate_manim_code": "Validate Manim code syntax",
             "GET /status": "Get server status",
             "GET /": "API information"
@@ -1,11 +1,25 @@
 import streamlit as st
 import os
-from openai import AzureOpenAI
+from openai import APIConnectionError, AzureOpenAI, InternalServerError, RateLimitError
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import base64
+import csv
+import io
+import random
+import re
+import time
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from dotenv import load_dotenv
+from opentelemetry import context as otel_context
+from opentelemetry import trace
+from opentelemetry.propagate import inject
+
+from tracing import setup_tracing
 
 # Load environment variables from .env file
 load_dotenv()
@@ -115,6 +129,25 @@ if "execution_time" not in st.session_state:
     st.session_state.execution_time = None
 if "enhanced_prompt" not in st.session_state:
     st.session_state.enhanced_prompt = None
+if "output_format" not in st.session_state:
+    st.session_state.output_format = "mp4"
+if "output_crf" not in st.session_state:
+    st.session_state.output_crf = None
+if "video_mime_type" not in st.session_state:
+    st.session_state.video_mime_type = "video/mp4"
+if "poster_image" not in st.session_state:
+    st.session_state.poster_image = None
+if "time_budget_s" not in st.session_state:
+    st.session_state.time_budget_s = None
+if "quality_info" not in st.session_state:
+    st.session_state.quality_info = None
+if "bulk_results" not in st.session_state:
+    st.session_state.bulk_results = None
+if "bulk_archive" not in st.session_state:
+    st.session_state.bulk_archive = None
+if "client_id" not in st.session_state:
+    # Identifies this browser session to the render server's fair scheduler
+    st.session_state.client_id = f"streamlit-{uuid.uuid4().hex[:12]}"
 
 # Detect environment and set appropriate server URL
 def get_server_url():
@@ -140,6 +173,9 @@ def get_server_url():
 
 MCP_SERVER_URL = get_server_url()
 
+# Most prompts accepted in one bulk run
+BULK_PROMPT_LIMIT = 50
+
 # Server status check
 @st.cache_data(ttl=60)
 def check_server_status(server_url: str) -> bool:
@@ -150,19 +186,75 @@ def check_server_status(server_url: str) -> bool:
     except requests.exceptions.RequestException:
         return False
 
+@st.cache_data(ttl=60)
+def get_render_concurrency(server_url: str):
+    """How many renders the server runs at once for one client, or None if unknown."""
+    try:
+        resp = requests.get(f"{server_url}/status", timeout=10)
+        return int(resp.json()["scheduler"]["client_concurrency"])
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+        return None
+
+# Tracing is configured once per process, not on every Streamlit rerun
+@st.cache_resource
+def get_tracer():
+    return setup_tracing("manim-streamlit-app")
+
+tracer = get_tracer()
+
 # Get Azure client with credentials from session state
 @st.cache_resource
 def get_azure_client(api_key, endpoint, api_version):
+    # Retries are handled by create_chat_completion, not stacked on top of the SDK's own
     return AzureOpenAI(
         api_key=api_key,
         api_version=api_version,
-        azure_endpoint=endpoint
+        azure_endpoint=endpoint,
+        max_retries=0,
     )
 
-def enhance_user_prompt(user_input: str, client) -> str:
+# Pooled HTTP session so repeated render calls reuse connections
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def create_chat_completion(client, max_attempts: int = 5, **kwargs):
+    """Call the chat API, backing off exponentially on 429s and transient failures."""
+    for attempt in range(max_attempts):
+        try:
+            return client.chat.completions.create(**kwargs)
+        except (RateLimitError, InternalServerError, APIConnectionError) as e:
+            if attempt == max_attempts - 1:
+                raise
+            # Prefer the server's Retry-After hint, otherwise 1s, 2s, 4s... with jitter
+            response = getattr(e, "response", None)
+            retry_after = response.headers.get("retry-after") if response is not None else None
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = 2 ** attempt
+            time.sleep(delay + random.uniform(0, 0.5))
+
+def clean_generated_code(manim_code: str) -> str:
+    """Strip markdown code fences the model sometimes wraps around code."""
+    if "```python" in manim_code:
+        return manim_code.split("```python")[1].split("```")[0].strip()
+    elif "```" in manim_code:
+        return manim_code.split("```")[1].split("```")[0].strip()
+    return manim_code
+
+@tracer.start_as_current_span("enhance_user_prompt")
+def enhance_user_prompt(user_input: str, client, deployment: str = None, warn=None) -> str:
     """
     First step: Convert user's casual description into a detailed, 
     structured prompt optimized for python code generation.
+    
+    deployment and warn default to the session's deployment and
+    st.warning; bulk mode passes its own since it runs off the script thread.
     """
     
     enhancement_prompt = """
@@ -197,8 +289,9 @@ Now convert this user input into a detailed, specific python animation prompt:
 """
     
     try:
-        response = client.chat.completions.create(
-            model=st.session_state.azure_deployment,
+        response = create_chat_completion(
+            client,
+            model=deployment or st.session_state.azure_deployment,
             messages=[
                 {"role": "system", "content": enhancement_prompt},
                 {"role": "user", "content": user_input},
@@ -210,10 +303,11 @@ Now convert this user input into a detailed, specific python animation prompt:
         return response.choices[0].message.content.strip()
     except Exception as e:
         # If enhancement fails, return original input
-        st.warning(f"⚠️ Prompt enhancement skipped: {str(e)}")
+        (warn or st.warning)(f"⚠️ Prompt enhancement skipped: {str(e)}")
         return user_input
 
-def generate_manim_code(enhanced_prompt: str, client) -> str:
+@tracer.start_as_current_span("generate_manim_code")
+def generate_manim_code(enhanced_prompt: str, client, deployment: str = None) -> str:
     """
     Second step: Generate Manim code from the enhanced, detailed prompt.
     """
@@ -279,8 +373,9 @@ ALTERNATE EXAMPLE (Simple text):
 """
 
     try:
-        response = client.chat.completions.create(
-            model=st.session_state.azure_deployment,
+        response = create_chat_completion(
+            client,
+            model=deployment or st.session_state.azure_deployment,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"Create this animation:\n{enhanced_prompt}"},
@@ -293,17 +388,36 @@ ALTERNATE EXAMPLE (Simple text):
     except Exception as e:
         raise Exception(f"Code generation failed: {str(e)}")
 
-def call_mcp_server(manim_code: str) -> dict:
+@tracer.start_as_current_span("call_mcp_server", kind=trace.SpanKind.CLIENT)
+def call_mcp_server(
+    manim_code: str,
+    output_format: str = "mp4",
+    crf: int = None,
+    time_budget_s: float = None,
+    client_id: str = None,
+    session: requests.Session = None,
+) -> dict:
     """Call the Azure Container Apps server to generate animation."""
     
     # Direct REST API call to Azure Container Apps
     url = f"{MCP_SERVER_URL}/generate_animation"
     
     try:
-        payload = {"manim_code": manim_code}
-        headers = {"Content-Type": "application/json"}
+        payload = {"manim_code": manim_code, "output_format": output_format}
+        if crf is not None:
+            payload["crf"] = crf
+        if time_budget_s is not None:
+            payload["time_budget_s"] = time_budget_s
+        headers = {
+            "Content-Type": "application/json",
+            "X-Client-ID": client_id or st.session_state.client_id,
+        }
+        # Carry the trace context across the network hop to the render server
+        inject(headers)
         
-        response = requests.post(url, json=payload, headers=headers, timeout=300)  # 5 minutes
+        session = session or get_http_session()
+        response = session.post(url, json=payload, headers=headers, timeout=300)  # 5 minutes
+        trace.get_current_span().set_attribute("http.status_code", response.status_code)
         
         if response.status_code == 200:
             result = response.json()
@@ -338,6 +452,238 @@ def call_mcp_server(manim_code: str) -> dict:
             "server_url": MCP_SERVER_URL
         }
 
+def parse_bulk_prompts(text: str, uploaded_file=None) -> list:
+    """Read prompts from an uploaded CSV/text file and the text box, one per line."""
+    prompts = []
+    if uploaded_file is not None:
+        content = uploaded_file.getvalue().decode("utf-8-sig")
+        if uploaded_file.name.lower().endswith(".csv"):
+            rows = list(csv.reader(io.StringIO(content)))
+            # Use the "prompt" column when there is a header, else the first column
+            column = 0
+            if rows and "prompt" in [cell.strip().lower() for cell in rows[0]]:
+                column = [cell.strip().lower() for cell in rows[0]].index("prompt")
+                rows = rows[1:]
+            prompts.extend(row[column] for row in rows if len(row) > column)
+        else:
+            prompts.extend(content.splitlines())
+    prompts.extend(text.splitlines())
+    return [p.strip() for p in prompts if p.strip()]
+
+def run_llm_stage(item: dict, client, deployment: str, trace_context) -> dict:
+    """Bulk pipeline stage 1: enhance the prompt and generate code."""
+    token = otel_context.attach(trace_context)
+    try:
+        start = time.time()
+        item["enhanced_prompt"] = enhance_user_prompt(
+            item["prompt"],
+            client,
+            deployment=deployment,
+            warn=item["notes"].append,
+        )
+        item["enhance_s"] = round(time.time() - start, 2)
+        
+        start = time.time()
+        item["manim_code"] = clean_generated_code(
+            generate_manim_code(item["enhanced_prompt"], client, deployment=deployment)
+        )
+        item["generate_s"] = round(time.time() - start, 2)
+        return item
+    finally:
+        otel_context.detach(token)
+
+def run_render_stage(item: dict, session: requests.Session, options: dict, trace_context) -> dict:
+    """Bulk pipeline stage 2: render the generated code on the server."""
+    token = otel_context.attach(trace_context)
+    try:
+        start = time.time()
+        item["result"] = call_mcp_server(item["manim_code"], session=session, **options)
+        item["render_s"] = round(time.time() - start, 2)
+        return item
+    finally:
+        otel_context.detach(token)
+
+def bulk_result_row(item: dict) -> dict:
+    """One line of the live results table and timing report."""
+    result = item.get("result") or {}
+    scheduling = result.get("scheduling") or {}
+    return {
+        "#": item["index"] + 1,
+        "prompt": item["prompt"],
+        "status": item["status"],
+        "enhance_s": item.get("enhance_s"),
+        "generate_s": item.get("generate_s"),
+        "render_s": item.get("render_s"),
+        "server_queue_s": scheduling.get("queue_wait_time"),
+        "server_exec_s": round(result["execution_time"], 2) if result.get("execution_time") else None,
+        "total_s": item.get("total_s"),
+        "error": item.get("error") or result.get("error"),
+        "notes": "; ".join(item.get("notes", [])),
+    }
+
+def build_bulk_archive(items: list) -> bytes:
+    """Zip all videos, their code and a per-item timing report."""
+    buffer = io.BytesIO()
+    rows = [bulk_result_row(item) for item in items]
+    
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for item in items:
+            slug = re.sub(r"[^a-z0-9]+", "_", item["prompt"].lower()).strip("_")[:40] or "animation"
+            name = f"{item['index'] + 1:03d}_{slug}"
+            result = item.get("result") or {}
+            
+            if result.get("success"):
+                extension = result.get("mime_type", "video/mp4").split("/")[-1]
+                # Videos are already compressed
+                archive.writestr(
+                    zipfile.ZipInfo(f"videos/{name}.{extension}"),
+                    base64.b64decode(result["video_data"]),
+                    compress_type=zipfile.ZIP_STORED,
+                )
+            if item.get("manim_code"):
+                archive.writestr(f"code/{name}.py", item["manim_code"])
+        
+        report = io.StringIO()
+        writer = csv.DictWriter(report, fieldnames=list(rows[0].keys()) if rows else ["#"])
+        writer.writeheader()
+        writer.writerows(rows)
+        archive.writestr("timing_report.csv", report.getvalue())
+        archive.writestr("timing_report.json", json.dumps(rows, indent=2))
+    
+    return buffer.getvalue()
+
+def run_bulk_pipeline(prompts: list, client, llm_concurrency: int, render_concurrency: int, table) -> list:
+    """
+    Run prompts through enhance/generate and render as a pipeline.
+    
+    Each stage has its own thread pool, so LLM calls for later prompts
+    overlap with renders of earlier ones. The table placeholder is
+    refreshed from the script thread whenever an item changes stage.
+    Renders beyond the server's per-client concurrency would only wait in
+    its queue, eating into the request timeout, so the caller caps
+    render_concurrency to that limit.
+    """
+    deployment = st.session_state.azure_deployment
+    session = get_http_session()
+    options = {
+        "output_format": st.session_state.output_format,
+        "crf": st.session_state.output_crf,
+        "time_budget_s": st.session_state.time_budget_s,
+        "client_id": st.session_state.client_id,
+    }
+    items = [
+        {"index": i, "prompt": prompt, "status": "⏳ waiting for LLM", "notes": [], "started": time.time()}
+        for i, prompt in enumerate(prompts)
+    ]
+    table.dataframe([bulk_result_row(item) for item in items], use_container_width=True)
+    
+    trace_context = otel_context.get_current()
+    llm_pool = ThreadPoolExecutor(max_workers=llm_concurrency)
+    render_pool = ThreadPoolExecutor(max_workers=render_concurrency)
+    try:
+        pending = {
+            llm_pool.submit(run_llm_stage, item, client, deployment, trace_context): ("llm", item)
+            for item in items
+        }
+        
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, item = pending.pop(future)
+                error = future.exception()
+                
+                if error is not None:
+                    item["status"] = "❌ failed"
+                    item["error"] = str(error)[:300]
+                    item["total_s"] = round(time.time() - item["started"], 2)
+                elif stage == "llm":
+                    item["status"] = "🎬 rendering"
+                    pending[render_pool.submit(run_render_stage, item, session, options, trace_context)] = ("render", item)
+                else:
+                    item["status"] = "✅ done" if item["result"].get("success") else "❌ failed"
+                    item["total_s"] = round(time.time() - item["started"], 2)
+            
+            table.dataframe([bulk_result_row(item) for item in items], use_container_width=True)
+    finally:
+        # A Stop or widget rerun interrupts the loop; don't block it on (or pay for) queued calls
+        llm_pool.shutdown(wait=False, cancel_futures=True)
+        render_pool.shutdown(wait=False, cancel_futures=True)
+    
+    return items
+
+def bulk_mode():
+    """Bulk prompt mode: many prompts, pipelined through all stages."""
+    st.markdown("### 📚 Bulk Prompts")
+    st.caption("One prompt per line, or upload a CSV (\"prompt\" column or first column) or text file")
+    
+    uploaded_file = st.file_uploader("Prompt list", type=["csv", "txt"])
+    prompt_text = st.text_area(
+        "Prompts",
+        placeholder="Show a blue circle morphing into a red square\nExplain the Pythagorean theorem",
+        height=180,
+        label_visibility="collapsed",
+    )
+    
+    # The server runs only this many renders per client at a time; more would just queue
+    server_concurrency = get_render_concurrency(MCP_SERVER_URL)
+    max_renders = min(server_concurrency or 8, 8)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        llm_concurrency = st.slider("Parallel LLM calls", min_value=1, max_value=8, value=3)
+    with col2:
+        if max_renders > 1:
+            render_concurrency = st.slider(
+                "Parallel renders",
+                min_value=1,
+                max_value=max_renders,
+                value=min(2, max_renders),
+            )
+        else:
+            render_concurrency = 1
+            st.caption("🎬 The server renders one animation at a time per client")
+    
+    run_button = st.button("🚀 Generate All", type="primary", use_container_width=True)
+    table = st.empty()
+    
+    if run_button:
+        prompts = parse_bulk_prompts(prompt_text, uploaded_file)
+        if not prompts:
+            st.warning("⚠️ Add at least one prompt")
+            return
+        if len(prompts) > BULK_PROMPT_LIMIT:
+            st.warning(
+                f"⚠️ Only the first {BULK_PROMPT_LIMIT} of {len(prompts)} prompts will be generated"
+            )
+            prompts = prompts[:BULK_PROMPT_LIMIT]
+        
+        client = get_azure_client(
+            st.session_state.azure_api_key,
+            st.session_state.azure_endpoint,
+            st.session_state.azure_api_version,
+        )
+        
+        start = time.time()
+        with tracer.start_as_current_span("bulk_request") as span:
+            span.set_attribute("bulk.prompts", len(prompts))
+            items = run_bulk_pipeline(prompts, client, llm_concurrency, render_concurrency, table)
+        
+        st.session_state.bulk_results = [bulk_result_row(item) for item in items]
+        st.session_state.bulk_archive = build_bulk_archive(items)
+        succeeded = sum(1 for item in items if (item.get("result") or {}).get("success"))
+        st.success(f"✅ {succeeded}/{len(items)} animations generated in {time.time() - start:.1f}s")
+    elif st.session_state.bulk_results:
+        table.dataframe(st.session_state.bulk_results, use_container_width=True)
+    
+    if st.session_state.bulk_archive:
+        st.download_button(
+            "📦 Download All (videos + timing report)",
+            data=st.session_state.bulk_archive,
+            file_name=f"animations_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+            mime="application/zip",
+            use_container_width=True,
+        )
+
 def main():
     st.title("🎬 Visualize Your Imagination")
     st.markdown('<p class="subtitle">✨ Transform your ideas into stunning mathematical animations with AI</p>', unsafe_allow_html=True)
@@ -369,6 +715,48 @@ def main():
                 value=st.session_state.azure_api_version,
             )
         
+        with st.expander("🎞️ Output Settings", expanded=False):
+            formats = ["mp4", "webm", "gif"]
+            st.session_state.output_format = st.selectbox(
+                "Format",
+                formats,
+                index=formats.index(st.session_state.output_format),
+                help="MP4 streams fastest, WebM is smaller, GIF is for previews",
+            )
+            
+            # CRF range differs per codec; GIF output has no CRF at all
+            crf_max = {"mp4": 51, "webm": 63}.get(st.session_state.output_format)
+            custom_quality = crf_max is not None and st.checkbox(
+                "Custom quality (CRF)",
+                value=st.session_state.output_crf is not None,
+                help="Lower CRF means higher quality and larger files",
+            )
+            if custom_quality:
+                st.session_state.output_crf = st.slider(
+                    "CRF",
+                    min_value=0,
+                    max_value=crf_max,
+                    value=min(st.session_state.output_crf or 28, crf_max),
+                )
+            else:
+                st.session_state.output_crf = None
+            
+            use_budget = st.checkbox(
+                "Render time budget",
+                value=st.session_state.time_budget_s is not None,
+                help="Let the server pick the highest quality that renders within the budget",
+            )
+            if use_budget:
+                st.session_state.time_budget_s = st.slider(
+                    "Budget (seconds)",
+                    min_value=10,
+                    max_value=300,
+                    value=int(st.session_state.time_budget_s or 60),
+                    step=10,
+                )
+            else:
+                st.session_state.time_budget_s = None
+        
         st.markdown("---")
         st.success("✅ AI-Enhanced Generation")
         st.caption("Smart prompts • Better code • Faster results")
@@ -382,6 +770,15 @@ def main():
         - Use Unicode for math: ², π, √
         """)
     
+    mode = st.radio("Mode", ["🎨 Single prompt", "📚 Bulk prompts"], horizontal=True, label_visibility="collapsed")
+    
+    if mode == "📚 Bulk prompts":
+        if not (st.session_state.azure_api_key and st.session_state.azure_endpoint and st.session_state.azure_deployment):
+            st.warning("⚠️ Please configure Azure OpenAI credentials in the sidebar to proceed.")
+            return
+        bulk_mode()
+        return
+    
     # Create two-column layout: input left, video right
     left_col, right_col = st.columns([1, 1])
     
@@ -411,25 +808,47 @@ def main():
                     st.session_state.last_prompt = ""
                     st.session_state.execution_time = None
                     st.session_state.enhanced_prompt = None
+                    st.session_state.poster_image = None
                     st.rerun()
     
     # Right column: Video display
     with right_col:
         if st.session_state.generated_video:
             st.markdown("### 🎬 Your Animation")
-            st.video(st.session_state.generated_video)
+            mime_type = st.session_state.video_mime_type
+            extension = mime_type.split("/")[-1]
+            if mime_type == "image/gif":
+                st.image(st.session_state.generated_video)
+            else:
+                st.video(st.session_state.generated_video, format=mime_type)
             
             st.download_button(
-                "📥 Download MP4",
+                f"📥 Download {extension.upper()}",
                 data=st.session_state.generated_video,
-                file_name=f"animation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp4",
-                mime="video/mp4",
+                file_name=f"animation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+                mime=mime_type,
                 use_container_width=True
             )
             
+            if st.session_state.poster_image:
+                st.download_button(
+                    "🖼️ Download Poster",
+                    data=st.session_state.poster_image,
+                    file_name=f"poster_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg",
+                    mime="image/jpeg",
+                    use_container_width=True
+                )
+            
             if st.session_state.execution_time:
                 st.success(f"⏱️ Generated in {st.session_state.execution_time}s")
             
+            quality = st.session_state.quality_info
+            if quality and quality.get("time_budget_s"):
+                st.caption(
+                    f"🎚️ Quality tier: {quality['tier']} • predicted {quality['predicted_time']}s, "
+                    f"actual {quality['actual_time']}s • restarts: {quality['restarts']}"
+                )
+            
             with st.expander("🐍 View Python Code for Animation"):
                 st.code(st.session_state.generated_code, language="python")
         else:
@@ -452,108 +871,121 @@ def main():
         return
     
     if generate_button and user_input:
-        # Validate Azure credentials
-        if not all([
-            st.session_state.azure_api_key,
-            st.session_state.azure_endpoint,
-            st.session_state.azure_deployment,
-        ]):
-            st.error("❌ Azure OpenAI credentials are incomplete")
-            return
+        # st.rerun() ends the script by raising, which is not an error for the trace
+        with tracer.start_as_current_span(
+            "animation_request",
+            record_exception=False,
+            set_status_on_exception=False,
+        ):
+            # Validate Azure credentials
+            if not all([
+                st.session_state.azure_api_key,
+                st.session_state.azure_endpoint,
+                st.session_state.azure_deployment,
+            ]):
+                st.error("❌ Azure OpenAI credentials are incomplete")
+                return
         
-        # Get Azure client
-        client = get_azure_client(
-            st.session_state.azure_api_key,
-            st.session_state.azure_endpoint,
-            st.session_state.azure_api_version,
-        )
+            # Get Azure client
+            client = get_azure_client(
+                st.session_state.azure_api_key,
+                st.session_state.azure_endpoint,
+                st.session_state.azure_api_version,
+            )
 
-        # Step 1: Enhance the user's prompt
-        try:
-            with st.spinner("🔍 Step 1/3: Analyzing and enhancing your prompt..."):
-                enhanced_prompt = enhance_user_prompt(user_input, client)
-                st.session_state.enhanced_prompt = enhanced_prompt
+            # Step 1: Enhance the user's prompt
+            try:
+                with st.spinner("🔍 Step 1/3: Analyzing and enhancing your prompt..."):
+                    enhanced_prompt = enhance_user_prompt(user_input, client)
+                    st.session_state.enhanced_prompt = enhanced_prompt
                 
-        except Exception as e:
-            st.error(f"❌ Failed to enhance prompt: {str(e)}")
-            st.info("💡 Check your Azure OpenAI credentials")
-            return
+            except Exception as e:
+                st.error(f"❌ Failed to enhance prompt: {str(e)}")
+                st.info("💡 Check your Azure OpenAI credentials")
+                return
 
-        # Step 2: Generate Manim code from enhanced prompt
-        try:
-            with st.spinner("🤖 Step 2/3: Generating python code..."):
-                manim_code = generate_manim_code(enhanced_prompt, client)
+            # Step 2: Generate Manim code from enhanced prompt
+            try:
+                with st.spinner("🤖 Step 2/3: Generating python code..."):
+                    manim_code = generate_manim_code(enhanced_prompt, client)
                 
-            # Clean the code if it's wrapped in markdown
-            if "```python" in manim_code:
-                manim_code = manim_code.split("```python")[1].split("```")[0].strip()
-            elif "```" in manim_code:
-                manim_code = manim_code.split("```")[1].split("```")[0].strip()
+                # Clean the code if it's wrapped in markdown
+                manim_code = clean_generated_code(manim_code)
                 
-        except Exception as e:
-            st.error(f"❌ Failed to generate code: {str(e)}")
-            st.info("💡 Try simplifying your prompt or check your Azure OpenAI credentials")
-            return
-
-        # Step 3: Render the animation
-        with st.spinner("🎬 Step 3/3: Rendering animation (up to 5 minutes for complex scenes)..."):
-            try:
-                result = call_mcp_server(manim_code)
             except Exception as e:
-                st.error(f"❌ Rendering failed: {str(e)}")
-                st.info("💡 The animation might be too complex or contain errors")
-                with st.expander("📝 Show Generated Code"):
-                    st.code(manim_code, language="python")
+                st.error(f"❌ Failed to generate code: {str(e)}")
+                st.info("💡 Try simplifying your prompt or check your Azure OpenAI credentials")
                 return
 
-        # Show any warnings
-        if result.get("warnings"):
-            for warning in result["warnings"]:
-                st.warning(f"⚠️ {warning}")
-
-        if result.get("success"):
-            st.session_state.generated_code = manim_code
-            st.session_state.last_prompt = user_input
-            st.session_state.execution_time = result.get("execution_time")
-
-            st.session_state.generated_video = base64.b64decode(
-                result["video_data"]
-            )
-
-            st.success("✅ Animation generated successfully")
-            st.rerun()
-        else:
-            error_msg = result.get("error", "Unknown error")
-            stderr_log = result.get("stderr", "")
-            st.error(f"❌ Animation generation failed")
+            # Step 3: Render the animation
+            with st.spinner("🎬 Step 3/3: Rendering animation (up to 5 minutes for complex scenes)..."):
+                try:
+                    result = call_mcp_server(
+                        manim_code,
+                        output_format=st.session_state.output_format,
+                        crf=st.session_state.output_crf,
+                        time_budget_s=st.session_state.time_budget_s,
+                    )
+                except Exception as e:
+                    st.error(f"❌ Rendering failed: {str(e)}")
+                    st.info("💡 The animation might be too complex or contain errors")
+                    with st.expander("📝 Show Generated Code"):
+                        st.code(manim_code, language="python")
+                    return
+
+            # Show any warnings
+            if result.get("warnings"):
+                for warning in result["warnings"]:
+                    st.warning(f"⚠️ {warning}")
+
+            if result.get("success"):
+                st.session_state.generated_code = manim_code
+                st.session_state.last_prompt = user_input
+                st.session_state.execution_time = result.get("execution_time")
+
+                st.session_state.generated_video = base64.b64decode(
+                    result["video_data"]
+                )
+                st.session_state.video_mime_type = result.get("mime_type", "video/mp4")
+                st.session_state.quality_info = result.get("quality")
+                st.session_state.poster_image = (
+                    base64.b64decode(result["poster_data"]) if result.get("poster_data") else None
+                )
+
+                st.success("✅ Animation generated successfully")
+                st.rerun()
+            else:
+                error_msg = result.get("error", "Unknown error")
+                stderr_log = result.get("stderr", "")
+                st.error(f"❌ Animation generation failed")
             
-            # Show detailed error in expander
-            with st.expander("🔍 Error Details", expanded=True):
-                st.code(error_msg, language="text")
+                # Show detailed error in expander
+                with st.expander("🔍 Error Details", expanded=True):
+                    st.code(error_msg, language="text")
                 
-                # Show full stderr if available
-                if stderr_log:
-                    st.markdown("**Full Error Log:**")
-                    st.code(stderr_log, language="text")
+                    # Show full stderr if available
+                    if stderr_log:
+                        st.markdown("**Full Error Log:**")
+                        st.code(stderr_log, language="text")
                 
-                # Show server info
-                if "server_url" in result:
-                    st.caption(f"Server: {result['server_url']}")
-                if "status_code" in result:
-                    st.caption(f"HTTP Status: {result['status_code']}")
+                    # Show server info
+                    if "server_url" in result:
+                        st.caption(f"Server: {result['server_url']}")
+                    if "status_code" in result:
+                        st.caption(f"HTTP Status: {result['status_code']}")
                 
-            # Show the generated code for debugging
-            with st.expander("📝 Generated Code (for debugging)"):
-                st.code(manim_code, language="python")
+                # Show the generated code for debugging
+                with st.expander("📝 Generated Code (for debugging)"):
+                    st.code(manim_code, language="python")
                 
-            # Show enhanced prompt
-            with st.expander("📋 Enhanced Prompt Used"):
-                st.text(enhanced_prompt)
+                # Show enhanced prompt
+                with st.expander("📋 Enhanced Prompt Used"):
+                    st.text(enhanced_prompt)
                 
-            st.info("💡 Tips: Try a simpler prompt, or check if the code has syntax errors")
+                st.info("💡 Tips: Try a simpler prompt, or check if the code has syntax errors")
             
-            # Suggest testing with simple prompt
-            st.warning("🧪 Try this simple test: 'Create a blue circle'", icon="💡")
+                # Suggest testing with simple prompt
+                st.warning("🧪 Try this simple test: 'Create a blue circle'", icon="💡")
     
     st.markdown("---")
     st.markdown('<p style="text-align: center; color: #667eea; font-weight: 500;">⚡ Powered by Azure AI • Manim Engine • Educational Excellence</p>', unsafe_allow_html=True)
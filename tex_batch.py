@@ -0,0 +1,191 @@
+"""
+Batched LaTeX pre-pass for Manim scenes.
+
+Manim compiles every Tex/MathTex object on its own, launching ``latex``
+and ``dvisvgm`` once per expression. This helper takes the Tex/MathTex
+calls extracted from a scene, compiles all of their expressions in one
+multi-page LaTeX run per chunk, converts each chunk with a single
+``dvisvgm`` call and stores the pages under the names manim's tex cache
+expects. The render then finds the SVGs ready and skips compilation.
+
+Usage:
+    python tex_batch.py <calls.json> <media_dir> [workers]
+
+Prints a JSON summary to stdout. Any failure leaves the cache untouched,
+so manim simply falls back to compiling the expressions itself.
+"""
+
+import json
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from manim import config
+from manim.mobject.text import tex_mobject
+from manim.utils.tex_file_writing import tex_hash
+
+# Default manim template; other document classes are left to manim
+STANDALONE_CLASS = r"\documentclass[preview]{standalone}"
+BATCH_CLASS = r"\documentclass[preview,multi=manimbatch]{standalone}"
+
+
+class _Captured(Exception):
+    """Carries the TeX code manim would compile for one object."""
+
+    def __init__(self, texcode: str):
+        super().__init__(texcode)
+        self.texcode = texcode
+
+
+def _capture_tex_to_svg_file(expression, environment=None, tex_template=None):
+    if tex_template is None:
+        tex_template = config["tex_template"]
+    if environment is not None:
+        texcode = tex_template.get_texcode_for_expression_in_env(expression, environment)
+    else:
+        texcode = tex_template.get_texcode_for_expression(expression)
+    raise _Captured(texcode)
+
+
+def collect_texcodes(calls: list) -> list:
+    """Run each call through manim's own Tex/MathTex preprocessing."""
+    original = tex_mobject.tex_to_svg_file
+    tex_mobject.tex_to_svg_file = _capture_tex_to_svg_file
+    texcodes = []
+    try:
+        for call in calls:
+            cls = getattr(tex_mobject, call["class"])
+            try:
+                cls(*call["args"], **call["kwargs"])
+            except _Captured as captured:
+                texcodes.append(captured.texcode)
+            except Exception:
+                # Let manim report problems with this expression during the render
+                continue
+    finally:
+        tex_mobject.tex_to_svg_file = original
+    return texcodes
+
+
+def _split_document(texcode: str):
+    preamble, _, rest = texcode.partition(r"\begin{document}")
+    body, _, _ = rest.partition(r"\end{document}")
+    return preamble, body
+
+
+def compile_chunk(index: int, preamble: str, bodies: list, tex_dir: Path) -> list:
+    """Compile one multi-page document and return the SVG path of each page."""
+    batch_tex = tex_dir / f"batch_{index:02d}.tex"
+    pages = "\n".join(f"\\begin{{manimbatch}}{body}\\end{{manimbatch}}" for body in bodies)
+    batch_tex.write_text(
+        preamble.replace(STANDALONE_CLASS, BATCH_CLASS)
+        + "\\begin{document}\n" + pages + "\n\\end{document}\n",
+        encoding="utf-8",
+    )
+
+    subprocess.run(
+        [
+            "latex",
+            "-interaction=batchmode",
+            "-halt-on-error",
+            f"-output-directory={tex_dir.as_posix()}",
+            batch_tex.as_posix(),
+        ],
+        stdout=subprocess.DEVNULL,
+        check=True,
+        timeout=120,
+    )
+    subprocess.run(
+        [
+            "dvisvgm",
+            "--page=1-",
+            "--no-fonts",
+            "--verbosity=0",
+            f"--output={(tex_dir / f'batch_{index:02d}-%p.svg').as_posix()}",
+            batch_tex.with_suffix(".dvi").as_posix(),
+        ],
+        stdout=subprocess.DEVNULL,
+        check=True,
+        timeout=120,
+    )
+
+    # dvisvgm zero-pads %p to the width of the page count, so sort numerically
+    svgs = sorted(
+        tex_dir.glob(f"batch_{index:02d}-*.svg"),
+        key=lambda svg: int(svg.stem.rsplit("-", 1)[1]),
+    )
+    if len(svgs) != len(bodies):
+        raise RuntimeError(f"dvisvgm produced {len(svgs)} pages for {len(bodies)} expressions in batch {index}")
+    return svgs
+
+
+def main() -> int:
+    calls = json.loads(Path(sys.argv[1]).read_text(encoding="utf-8"))
+    config.media_dir = sys.argv[2]
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+
+    tex_dir = config.get_dir("tex_dir")
+    tex_dir.mkdir(parents=True, exist_ok=True)
+
+    summary = {"calls": len(calls), "expressions": 0, "cached": 0, "compiled": 0,
+               "latex_runs": 0, "dvisvgm_runs": 0, "launches_saved": 0, "seeded": False}
+
+    pending = {}
+    preamble = None
+    for texcode in collect_texcodes(calls):
+        summary["expressions"] += 1
+        name = tex_hash(texcode)
+        if (tex_dir / f"{name}.svg").exists() or name in pending:
+            summary["cached"] += 1
+            continue
+        doc_preamble, body = _split_document(texcode)
+        # Only the stock template, and one preamble per batch
+        if STANDALONE_CLASS not in doc_preamble or (preamble is not None and doc_preamble != preamble):
+            continue
+        preamble = doc_preamble
+        pending[name] = (texcode, body)
+
+    # A single expression gains nothing from batching
+    if len(pending) < 2:
+        print(json.dumps(summary))
+        return 0
+
+    names = list(pending)
+    workers = max(1, min(workers, len(names) // 2))
+    chunks = [names[i::workers] for i in range(workers)]
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(
+                lambda item: compile_chunk(item[0], preamble, [pending[n][1] for n in item[1]], tex_dir),
+                enumerate(chunks),
+            ))
+
+        for chunk, svgs in zip(chunks, results):
+            for name, svg in zip(chunk, svgs):
+                # Write the .tex too so manim's cache check sees a complete entry
+                (tex_dir / f"{name}.tex").write_text(pending[name][0], encoding="utf-8")
+                svg.replace(tex_dir / f"{name}.svg")
+    except (subprocess.SubprocessError, OSError, RuntimeError) as e:
+        summary["error"] = str(e)[:500]
+        print(json.dumps(summary))
+        return 0
+    finally:
+        for leftover in tex_dir.glob("batch_*"):
+            leftover.unlink()
+
+    summary.update({
+        "compiled": len(names),
+        "latex_runs": len(chunks),
+        "dvisvgm_runs": len(chunks),
+        # Manim would have run latex and dvisvgm once per expression
+        "launches_saved": 2 * len(names) - 2 * len(chunks),
+        "seeded": True,
+    })
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
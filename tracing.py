@@ -0,0 +1,55 @@
+"""
+Shared OpenTelemetry setup for the Streamlit app and the Manim server.
+
+Configured through environment variables:
+
+    TRACING_EXPORTER      otlp | file | none (default: none)
+    TRACING_SAMPLE_RATIO  fraction of new traces to record (default: 1.0)
+    TRACING_FILE          output path for the file exporter (default: traces.jsonl)
+
+The OTLP exporter reads the standard OTEL_EXPORTER_OTLP_* variables for
+its endpoint and headers. For offline inspection use the file exporter,
+which writes one JSON span per line. With the exporter set to "none" no
+tracer provider is installed and every span is a no-op.
+"""
+
+import os
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+def setup_tracing(service_name: str) -> trace.Tracer:
+    """Install the configured tracer provider and return a tracer for the service."""
+    exporter_name = os.getenv("TRACING_EXPORTER", "none").lower()
+    if exporter_name == "none":
+        return trace.get_tracer(service_name)
+
+    # Follow the caller's sampling decision so a trace is never half-recorded
+    ratio = float(os.getenv("TRACING_SAMPLE_RATIO", "1.0"))
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}),
+        sampler=ParentBased(TraceIdRatioBased(ratio)),
+    )
+
+    if exporter_name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    elif exporter_name == "file":
+        trace_file = open(os.getenv("TRACING_FILE", "traces.jsonl"), "a", encoding="utf-8")
+        exporter = ConsoleSpanExporter(
+            out=trace_file,
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+    else:
+        print(f"Warning: Unknown TRACING_EXPORTER '{exporter_name}', tracing disabled")
+        return trace.get_tracer(service_name)
+
+    trace.set_tracer_provider(provider)
+    return trace.get_tracer(service_name)